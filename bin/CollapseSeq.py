@@ -7,10 +7,13 @@ __author__ = 'Jason Anthony Vander Heiden'
 from presto import __version__, __date__
 
 # Imports
+import math
 import os
-import re
+import multiprocessing as mp
+import numpy as np
 from argparse import ArgumentParser
-from collections import OrderedDict
+from array import array
+from functools import partial
 from itertools import chain
 from textwrap import dedent
 from time import time
@@ -21,12 +24,112 @@ from presto.Defaults import default_delimiter, default_out_args
 from presto.Commandline import CommonHelpFormatter, checkArgs, getCommonArgParser, parseCommonArgs
 from presto.Annotation import parseAnnotation, flattenAnnotation, mergeAnnotation, \
                               collapseAnnotation
-from presto.Sequence import checkSeqEqual
-from presto.IO import getFileType, readSeqFile, getOutputHandle, openFile, printLog, printProgress
+from presto.IO import getFileType, readSeqFile, getOutputHandle, openFile, printError, \
+                      printLog, printProgress
 
 # Default parameters
 default_max_missing = 0
 
+# Cache of mean quality scores keyed by record identity
+_qmean_cache = {}
+
+
+def qualityMean(seq, cache=_qmean_cache):
+    """
+    Calculates the mean quality score of a sequence, memoizing the result
+
+    Arguments:
+      seq : SeqRecord with phred_quality letter annotations.
+      cache : dictionary in which to store computed means keyed by record identity.
+
+    Returns:
+      float: mean phred quality score.
+    """
+    qmean = cache.get(id(seq))
+    if qmean is None:
+        quals = seq.letter_annotations['phred_quality']
+        qmean = float(np.frombuffer(array('B', quals), dtype=np.uint8).mean())
+        cache[id(seq)] = qmean
+
+    return qmean
+
+
+# Cache of encoded sequence arrays keyed by sequence string
+_encode_cache = {}
+
+
+def encodeSeq(seq_str, cache=_encode_cache):
+    """
+    Encodes a sequence string for missing character aware comparison
+
+    Arguments:
+      seq_str : sequence string to encode.
+      cache : dictionary in which to store encodings keyed by sequence string.
+
+    Returns:
+      tuple: (uint8 array of the sequence, boolean array of missing positions).
+    """
+    encoded = cache.get(seq_str)
+    if encoded is None:
+        arr = np.frombuffer(seq_str.encode(), dtype=np.uint8)
+        missing = (arr == ord('.')) | (arr == ord('-')) | (arr == ord('N')) | (arr == ord('n'))
+        encoded = (arr, missing)
+        cache[seq_str] = encoded
+
+    return encoded
+
+
+# Cache of parsed description annotations keyed by record identity
+_ann_cache = {}
+
+
+def parseAnnotationCached(seq, delimiter=default_delimiter, cache=_ann_cache):
+    """
+    Parses the full annotation of a record description, memoizing the result
+
+    Arguments:
+      seq : SeqRecord with an annotated description.
+      delimiter : description field delimiter.
+      cache : dictionary in which to store parsed annotations keyed by record identity.
+
+    Returns:
+      OrderedDict: the parsed annotation dictionary. The cached dictionary is
+      returned directly, so callers must copy it before modification.
+    """
+    ann = cache.get(id(seq))
+    if ann is None:
+        ann = parseAnnotation(seq.description, delimiter=delimiter)
+        cache[id(seq)] = ann
+
+    return ann
+
+
+# Cache of numeric annotation values keyed by (record identity, field)
+_field_cache = {}
+
+
+def annotationValue(seq, field, delimiter=default_delimiter, cache=_field_cache):
+    """
+    Extracts a numeric annotation value from a record, memoizing the result
+
+    Arguments:
+      seq : SeqRecord with an annotated description.
+      field : annotation field containing the numeric value.
+      delimiter : description field delimiter.
+      cache : dictionary in which to store parsed values keyed by
+              (record identity, field).
+
+    Returns:
+      float: the annotation value.
+    """
+    value = cache.get((id(seq), field))
+    if value is None:
+        value = float(parseAnnotationCached(seq, delimiter=delimiter)[field])
+        cache[(id(seq), field)] = value
+
+    return value
+
+
 class DuplicateSet:
     """
     A class defining unique sequence sets
@@ -38,6 +141,9 @@ class DuplicateSet:
       keys : list of sequence identifier.
       count : duplicate count.
     """
+    # Preallocate attribute slots to skip the per-instance __dict__
+    __slots__ = ('seq', 'missing', 'annotations', 'keys', 'count')
+
     # Instantiation
     def __init__(self, seq, key, missing, annotations):
         self.seq = seq
@@ -51,35 +157,33 @@ class DuplicateSet:
         return len(self.keys)
 
 
-def findUID(uid, search_dict, score=False):
+def findUID(uid, candidates):
     """
-    Checks if a unique identifier is already present in a unique dictionary
+    Searches for an ambiguous match to a unique identifier among candidate identifiers
 
     Arguments:
       uid : the unique identifier key to check.
-      search_dict : a dictionary to search for key matches in.
-      score : if True score sequence element of the uid against each sequence in search_list.
+      candidates : an iterable of uid keys with matching length and annotations
+                   to score the sequence against.
 
     Returns:
-      str: uid of match if found; None otherwise.
+      tuple: uid of match if found; None otherwise.
     """
     match = None
-    # Check for exact matches
-    if not score:
-        match = uid if uid in search_dict else None
-    # Check for ambiguous matches
-    else:
-        for key in search_dict:
-            if uid[1:] == key[1:] and checkSeqEqual(uid[0], key[0]):
-                match = key
-                break
+    # Check for ambiguous matches with vectorized equality
+    seq_arr, seq_missing = encodeSeq(uid[0])
+    for key in candidates:
+        key_arr, key_missing = encodeSeq(key[0])
+        if ((seq_arr == key_arr) | seq_missing | key_missing).all():
+            match = key
+            break
 
     # Return search boolean
     return match
 
 
-def findUniqueSeq(uniq_dicts, search_keys, seq_dict, max_missing=default_max_missing, 
-                  uniq_fields=None, copy_fields=None, max_field=None, min_field=None,
+def findUniqueSeq(uniq_dicts, search_keys, seq_dict, seq_meta, max_missing=default_max_missing,
+                  copy_fields=None, max_field=None, min_field=None,
                   inner=False, delimiter=default_delimiter):
     """
     Finds unique sequences
@@ -88,8 +192,9 @@ def findUniqueSeq(uniq_dicts, search_keys, seq_dict, max_missing=default_max_mis
       uniq_dicts: a dictionary of length segregated dictionaries of unique sequences generated by findUniqueSeq().
       search_keys : a list containing the subset of dictionary keys to be checked.
       seq_dict : a SeqRecords dictionary generated by SeqIO.index().
+      seq_meta : a dictionary mapping record keys to (sequence string, ambiguous character count,
+                 unique identifier tuple, full sequence string) tuples precomputed by collapseSeq().
       max_missing : the number of missing characters to allow in a unique sequences.
-      uniq_fields : a list of annotations that define a sequence as unique if they differ.
       copy_fields : a list of annotations to copy into unique sequence annotations.
       max_field : a numeric field whose maximum value determines the retained sequence.
       min_field : a numeric field whose minimum value determines the retained sequence.
@@ -103,89 +208,106 @@ def findUniqueSeq(uniq_dicts, search_keys, seq_dict, max_missing=default_max_mis
     all unique sequences of a specific length.  
     """
     # Define local variables
-    ambig_re = re.compile(r'[\.\-N]')
     score = (max_missing > 0)
     dup_keys = []
-    to_remove = []
+    keep = bytearray(b'\x01' * len(search_keys))
+
+    # Select the copy annotation and swap criteria functions up front so the
+    # option flags are not re-tested for every record
+    if copy_fields is not None:
+        def _cid(seq):
+            ann = parseAnnotation(seq.description, copy_fields, delimiter=delimiter)
+            return {k:[ann.get(k)] for k in copy_fields}
+    else:
+        def _cid(seq):  return {}
+
+    if max_field is not None:
+        def _swap(seq, seq_last):
+            return annotationValue(seq, max_field, delimiter=delimiter) > \
+                   annotationValue(seq_last, max_field, delimiter=delimiter)
+    elif min_field is not None:
+        def _swap(seq, seq_last):
+            return annotationValue(seq, min_field, delimiter=delimiter) > \
+                   annotationValue(seq_last, min_field, delimiter=delimiter)
+    else:
+        def _swap(seq, seq_last):
+            if hasattr(seq, 'letter_annotations') and 'phred_quality' in seq.letter_annotations:
+                return qualityMean(seq) > qualityMean(seq_last)
+            return False
+
+    # Index unique sequences by annotation suffix so scored searches only
+    # compare candidates that can actually match
+    if score:
+        uniq_index = {}
+        for seq_len, uniq_dict in uniq_dicts.items():
+            index = uniq_index.setdefault(seq_len, {})
+            for uid in uniq_dict:
+                index.setdefault(uid[1:], []).append(uid)
 
     start_time = time()
     result_count = len(search_keys)
+    # Hoist loop invariants; the progress callback is gated on its own print
+    # step so the per-record cost is a single modulo instead of a call
+    task = '%i missing' % max_missing
+    progress_step = math.ceil(0.05 * result_count)
     # Iterate over search keys and update uniq_dict and dup_keys
     for idx, key in enumerate(search_keys):
         # Print progress of previous iteration
-        printProgress(idx, result_count, 0.05, start_time=start_time, task='%i missing' % max_missing)
+        if progress_step and idx % progress_step == 0:
+            printProgress(idx, result_count, 0.05, start_time=start_time, task=task)
 
         # Define sequence to process
         seq = seq_dict[key]
-        seq_str = str(seq.seq)
-        if inner:  seq_str = seq_str.strip('.-N')
+        seq_str, ambig_count, uid = seq_meta[key][:3]
 
         # Skip processing of ambiguous sequences over max_missing threshold
-        ambig_count = len(ambig_re.findall(seq_str))
         if ambig_count > max_missing:  continue
 
-        # Parse annotation and define unique identifiers (uid)
-        if uniq_fields is not None:
-            ann = parseAnnotation(seq_dict[key].description, uniq_fields, delimiter=delimiter)
-            uid = tuple(chain([seq_str], list(ann.values())))
-        else:
-            uid = (seq_str, None)
-
         # Parse annotation and define copied identifiers (cid)
-        if copy_fields is not None:
-            ann = parseAnnotation(seq.description, copy_fields, delimiter=delimiter)
-            cid = {k:[ann.get(k)] for k in copy_fields}
-        else:
-            cid = {}
+        cid = _cid(seq)
 
         ##  use or create length specific uniq_dict
         seq_len=len(uid[0])
         uniq_dict=uniq_dicts.setdefault(seq_len, {})
         
         # Store new unique sequences and process duplicates
-        match = findUID(uid, uniq_dict, score)
-        if match is None:
+        if not score:
+            # Exact match requires only a single hash lookup
+            entry = uniq_dict.get(uid)
+        else:
+            index = uniq_index.setdefault(seq_len, {})
+            match = findUID(uid, index.get(uid[1:], ()))
+            entry = uniq_dict[match] if match is not None else None
+        if entry is None:
             uniq_dict[uid] = DuplicateSet(seq, key=key, missing=ambig_count, annotations=cid)
+            if score:  index.setdefault(uid[1:], []).append(uid)
         else:
             # Updated sequence, count, ambiguous character count, and count sets
             dup_key = key
-            uniq_dict[match].count += 1
-            uniq_dict[match].keys.append(key)
+            entry.count += 1
+            entry.keys.append(key)
             for k, v in cid.items():
-                uniq_dict[match].annotations[k].extend(v)
+                entry.annotations[k].extend(v)
             # Check whether to replace previous unique sequence with current sequence
-            if ambig_count <= uniq_dict[match].missing:
-                swap = False
-                seq_last = uniq_dict[match].seq
-                if max_field is not None:
-                    swap = float(parseAnnotation(seq.description, delimiter=delimiter)[max_field]) > \
-                           float(parseAnnotation(seq_last.description, delimiter=delimiter)[max_field])
-                elif min_field is not None:
-                    swap = float(parseAnnotation(seq.description, delimiter=delimiter)[min_field]) > \
-                           float(parseAnnotation(seq_last.description, delimiter=delimiter)[min_field])
-                # TODO:  quality evaluation is a bottleneck
-                else:
-                    if hasattr(seq, 'letter_annotations') and 'phred_quality' in seq.letter_annotations:
-                        q_this = float(sum(seq.letter_annotations['phred_quality'])) / len(seq)
-                        q_last = float(sum(seq_last.letter_annotations['phred_quality'])) / len(seq_last)
-                        swap = q_this > q_last
+            if ambig_count <= entry.missing:
+                seq_last = entry.seq
                 # Replace old sequence if criteria passed
-                if swap:
+                if _swap(seq, seq_last):
                     dup_key = seq_last.id
-                    uniq_dict[match].seq = seq
-                    uniq_dict[match].missing = ambig_count
+                    entry.seq = seq
+                    entry.missing = ambig_count
 
             # Update duplicate list
             dup_keys.append(dup_key)
 
         # Mark seq for removal from later steps
-        to_remove.append(idx)
+        keep[idx] = 0
 
-    # Remove matched sequences from search_keys
-    for j in reversed(to_remove):  del search_keys[j]
+    # Remove matched sequences from search_keys in a single pass
+    search_keys[:] = [k for k, m in zip(search_keys, keep) if m]
 
     # Update progress
-    printProgress(result_count, result_count, 0.05, start_time=start_time, task='%i missing' % max_missing)
+    printProgress(result_count, result_count, 0.05, start_time=start_time, task=task)
 
     return (uniq_dicts, search_keys, dup_keys)  
 
@@ -217,7 +339,7 @@ def collapseSeq(seq_file, max_missing=default_max_missing, uniq_fields=None,
     Returns:
       str: the collapsed output file name.
     """
-    log = OrderedDict()
+    log = {}
     log['START'] = 'CollapseSeq'
     log['FILE'] = os.path.basename(seq_file)
     log['MAX_MISSING'] = max_missing
@@ -235,9 +357,44 @@ def collapseSeq(seq_file, max_missing=default_max_missing, uniq_fields=None,
 
     # Read input file
     in_type = getFileType(seq_file)
-    seq_dict = SeqIO.to_dict(readSeqFile(seq_file, index=False))
     if out_args['out_type'] is None:  out_args['out_type'] = in_type
 
+    # Stream the input in a single pass collecting records and sequence
+    # strings; both are invariant across the max_missing passes
+    seq_dict = {}
+    seq_strs = []
+    full_strs = []
+    for seq in readSeqFile(seq_file):
+        if seq.id in seq_dict:
+            printError('Duplicate sequence identifier %s in file %s.' % (seq.id, seq_file))
+        seq_dict[seq.id] = seq
+        full_str = seq_str = str(seq.seq)
+        if inner:  seq_str = seq_str.strip('.-N')
+        seq_strs.append(seq_str)
+        full_strs.append(full_str)
+
+    # Count ambiguous characters for the whole dataset in one vectorized pass
+    # over the concatenated sequences
+    lengths = np.fromiter((len(s) for s in seq_strs), dtype=np.intp, count=len(seq_strs))
+    concat = np.frombuffer(''.join(seq_strs).encode(), dtype=np.uint8)
+    missing = (concat == ord('.')) | (concat == ord('-')) | (concat == ord('N'))
+    missing_cum = np.concatenate(([0], np.cumsum(missing)))
+    ends = np.cumsum(lengths)
+    ambig_counts = missing_cum[ends] - missing_cum[ends - lengths]
+
+    # Define the per-record metadata used by findUniqueSeq. The unique
+    # identifier (uid) is built once; reusing the same tuple across passes
+    # lets the cached string hash be computed only once per record.
+    seq_meta = {}
+    for (key, seq), seq_str, full_str, ambig_count in \
+            zip(seq_dict.items(), seq_strs, full_strs, ambig_counts):
+        if uniq_fields is not None:
+            ann = parseAnnotation(seq.description, uniq_fields, delimiter=out_args['delimiter'])
+            uid = tuple(chain([seq_str], list(ann.values())))
+        else:
+            uid = (seq_str, None)
+        seq_meta[key] = (seq_str, int(ambig_count), uid, full_str)
+
     # Count total sequences
     rec_count = len(seq_dict)
 
@@ -268,8 +425,8 @@ def collapseSeq(seq_file, max_missing=default_max_missing, uniq_fields=None,
     dup_keys = []
     for n in range(0, max_missing + 1):
         # Find unique sequences
-        uniq_dicts, search_keys, dup_list = findUniqueSeq(uniq_dicts, search_keys, seq_dict, n, 
-                                                         uniq_fields, copy_fields,
+        uniq_dicts, search_keys, dup_list = findUniqueSeq(uniq_dicts, search_keys, seq_dict, seq_meta, n,
+                                                         copy_fields,
                                                          max_field, min_field, inner,
                                                          out_args['delimiter'])
 
@@ -282,64 +439,82 @@ def collapseSeq(seq_file, max_missing=default_max_missing, uniq_fields=None,
     ## merge all uniq_dicts into one dict here.
     uniq_dict=merge_dicts(uniq_dicts)
 
-    # Write unique sequences
-    for val in uniq_dict.values():
-        # Define output sequence
-        out_seq = val.seq
-        out_ann = parseAnnotation(out_seq.description, delimiter=out_args['delimiter'])
-        out_app = OrderedDict()
-        if copy_fields  is not None and copy_actions is not None:
-            for f, a in zip(copy_fields, copy_actions):
-                x = collapseAnnotation(val.annotations, a, f, delimiter=out_args['delimiter'])
-                out_app[f] = x[f]
-                out_ann.pop(f, None)
-        out_app['DUPCOUNT'] = val.count
-        out_ann = mergeAnnotation(out_ann, out_app, delimiter=out_args['delimiter'])
-        out_seq.id = out_seq.name = flattenAnnotation(out_ann, delimiter=out_args['delimiter'])
-        out_seq.description = ''
-        # Write unique sequence
-        SeqIO.write(out_seq, pass_handle, out_args['out_type'])
-
-        # Update log
-        log = OrderedDict()
-        log['HEADER'] = out_seq.id
-        log['DUPCOUNT'] = val.count
-        for i, k in enumerate(val.keys, start=1):
-            log['ID%i' % i] = k
-        for i, k in enumerate(val.keys, start=1):
-            log['SEQ%i' % i] = str(seq_dict[k].seq)
-        printLog(log, handle=log_handle)
+    # Generator of finalized unique sequences
+    def _iterUnique():
+        for val in uniq_dict.values():
+            # Define output sequence
+            out_seq = val.seq
+            out_ann = parseAnnotationCached(out_seq, delimiter=out_args['delimiter']).copy()
+            out_app = {}
+            if copy_fields  is not None and copy_actions is not None:
+                for f, a in zip(copy_fields, copy_actions):
+                    x = collapseAnnotation(val.annotations, a, f, delimiter=out_args['delimiter'])
+                    out_app[f] = x[f]
+                    out_ann.pop(f, None)
+            out_app['DUPCOUNT'] = val.count
+            out_ann = mergeAnnotation(out_ann, out_app, delimiter=out_args['delimiter'])
+            out_seq.id = out_seq.name = flattenAnnotation(out_ann, delimiter=out_args['delimiter'])
+            out_seq.description = ''
 
-    # Write sequence with high missing character counts
-    if keep_missing:
+            # Update log
+            log = {}
+            log['HEADER'] = out_seq.id
+            log['DUPCOUNT'] = val.count
+            for i, k in enumerate(val.keys, start=1):
+                log['ID%i' % i] = k
+            for i, k in enumerate(val.keys, start=1):
+                log['SEQ%i' % i] = seq_meta[k][3]
+            printLog(log, handle=log_handle)
+
+            yield out_seq
+
+    # Generator of retained sequences with high missing character counts
+    def _iterMissing():
         for k in search_keys:
             out_seq = seq_dict[k]
-            out_ann = parseAnnotation(out_seq.description, delimiter=out_args['delimiter'])
+            out_ann = parseAnnotationCached(out_seq, delimiter=out_args['delimiter']).copy()
             out_ann = mergeAnnotation(out_ann, {'DUPCOUNT':1}, delimiter=out_args['delimiter'])
             out_seq.id = out_seq.name = flattenAnnotation(out_ann, delimiter=out_args['delimiter'])
             out_seq.description = ''
-            SeqIO.write(out_seq, pass_handle, out_args['out_type'])
+            yield out_seq
+
+    # Write unique sequences in a single batched call
+    SeqIO.write(_iterUnique(), pass_handle, out_args['out_type'])
 
     # Write sequence with high missing character counts
-    if out_args['failed'] and not keep_missing:
-        with getOutputHandle(seq_file, 'collapse-undetermined', out_dir=out_args['out_dir'],
-                             out_name=out_args['out_name'], out_type=out_args['out_type'],
-                             gzip_output=out_args.get('gzip_output', False)) \
-                as missing_handle:
-            for k in search_keys:
-                SeqIO.write(seq_dict[k], missing_handle, out_args['out_type'])
+    if keep_missing:
+        SeqIO.write(_iterMissing(), pass_handle, out_args['out_type'])
 
+    # Write failed records by routing a single pass over the input records
+    # through set membership instead of one random access per key
     if out_args['failed']:
+        dup_set = frozenset(dup_keys)
+        undet_set = frozenset() if keep_missing else frozenset(search_keys)
+        dup_records = []
+        undet_records = []
+        for k, rec in seq_dict.items():
+            if k in dup_set:
+                dup_records.append(rec)
+            elif k in undet_set:
+                undet_records.append(rec)
+
+        # Write sequences with high missing character counts
+        if not keep_missing:
+            with getOutputHandle(seq_file, 'collapse-undetermined', out_dir=out_args['out_dir'],
+                                 out_name=out_args['out_name'], out_type=out_args['out_type'],
+                                 gzip_output=out_args.get('gzip_output', False)) \
+                    as missing_handle:
+                SeqIO.write(undet_records, missing_handle, out_args['out_type'])
+
         # Write duplicate sequences
         with getOutputHandle(seq_file, 'collapse-duplicate', out_dir=out_args['out_dir'],
                              out_name=out_args['out_name'], out_type=out_args['out_type'],
                              gzip_output=out_args.get('gzip_output', False)) \
                 as dup_handle:
-            for k in dup_keys:
-                SeqIO.write(seq_dict[k], dup_handle, out_args['out_type'])
+            SeqIO.write(dup_records, dup_handle, out_args['out_type'])
 
     # Print log
-    log = OrderedDict()
+    log = {}
     log['OUTPUT'] = os.path.basename(pass_handle.name)
     log['SEQUENCES'] = rec_count
     log['UNIQUE'] = len(uniq_dict)
@@ -348,6 +523,12 @@ def collapseSeq(seq_file, max_missing=default_max_missing, uniq_fields=None,
     log['END'] = 'CollapseSeq'
     printLog(log)
 
+    # Clear sequence, annotation, and quality score caches
+    _encode_cache.clear()
+    _qmean_cache.clear()
+    _ann_cache.clear()
+    _field_cache.clear()
+
     # Close file handles
     pass_file = pass_handle.name
     if pass_handle is not None:  pass_handle.close()
@@ -356,6 +537,21 @@ def collapseSeq(seq_file, max_missing=default_max_missing, uniq_fields=None,
     return pass_file
 
 
+def collapseSeqFile(seq_file, out_file, args_dict):
+    """
+    Worker wrapper around collapseSeq for multiprocessing dispatch
+
+    Arguments:
+      seq_file : filename of the sequence file to process.
+      out_file : output file name or None.
+      args_dict : dictionary of remaining collapseSeq keyword arguments.
+
+    Returns:
+      str: the collapsed output file name.
+    """
+    return collapseSeq(seq_file=seq_file, out_file=out_file, **args_dict)
+
+
 def getArgParser():
     """
     Defines the ArgumentParser
@@ -391,7 +587,7 @@ def getArgParser():
     # TODO: write better algorithm for ambiguous character mode
     # Define ArgumentParser
     parser = ArgumentParser(description=__doc__, epilog=fields,
-                            parents=[getCommonArgParser()],
+                            parents=[getCommonArgParser(multiproc=True)],
                             formatter_class=CommonHelpFormatter, add_help=False)
 
     # Collapse arguments
@@ -466,8 +662,15 @@ if __name__ == '__main__':
     # Call appropriate function for each sample file
     del args_dict['seq_files']
     if 'out_files' in args_dict:  del args_dict['out_files']
-    for i, f in enumerate(args.__dict__['seq_files']):
-        args_dict['seq_file'] = f
-        args_dict['out_file'] = args.__dict__['out_files'][i] \
-            if args.__dict__['out_files'] else None
-        collapseSeq(**args_dict)
+    nproc = args_dict.pop('nproc')
+    seq_files = args.__dict__['seq_files']
+    out_files = args.__dict__['out_files'] if args.__dict__['out_files'] \
+                else [None] * len(seq_files)
+    if nproc > 1 and len(seq_files) > 1:
+        # Input files are independent, so process each file in its own worker
+        with mp.Pool(processes=min(nproc, len(seq_files))) as pool:
+            pool.starmap(partial(collapseSeqFile, args_dict=args_dict),
+                         zip(seq_files, out_files))
+    else:
+        for f, o in zip(seq_files, out_files):
+            collapseSeqFile(f, o, args_dict)
@@ -7,12 +7,12 @@ __author__ = 'Jason Anthony Vander Heiden'
 from presto import __version__, __date__
 
 # Imports
+import multiprocessing as mp
 import os
 from argparse import ArgumentParser
-from collections import OrderedDict
+from functools import partial
 from textwrap import dedent
 from time import time
-from Bio import SeqIO
 
 # Presto imports
 from presto.Defaults import default_out_args
@@ -20,8 +20,8 @@ from presto.Annotation import flattenAnnotation, convertGenericHeader, convert45
                               convertGenbankHeader, convertIlluminaHeader, convertIMGTHeader, \
                               convertSRAHeader, convertMIGECHeader
 from presto.Commandline import CommonHelpFormatter, checkArgs, getCommonArgParser, parseCommonArgs
-from presto.IO import getFileType, readSeqFile, countSeqFile, getOutputHandle, \
-                      openFile, printLog, printProgress
+from presto.IO import getFileType, readSeqTuples, formatSeqString, \
+                      getOutputHandle, openFile, printLog, printCount, printError
 
 
 def convertHeaders(seq_file, convert_func, convert_args={}, out_file=None, out_args=default_out_args):
@@ -47,7 +47,7 @@ def convertHeaders(seq_file, convert_func, convert_args={}, out_file=None, out_a
                 convertMIGECHeader: 'migec',
                 convertSRAHeader: 'sra'}
 
-    log = OrderedDict()
+    log = {}
     log['START'] = 'ConvertHeaders'
     log['COMMAND'] = cmd_dict[convert_func]
     log['FILE'] = os.path.basename(seq_file)
@@ -55,7 +55,7 @@ def convertHeaders(seq_file, convert_func, convert_args={}, out_file=None, out_a
 
     # Open input file
     in_type = getFileType(seq_file)
-    seq_iter = readSeqFile(seq_file)
+    seq_iter = readSeqTuples(seq_file)
     if out_args['out_type'] is None:  out_args['out_type'] = in_type
 
     # Wrapper for opening handles and writers
@@ -74,9 +74,6 @@ def convertHeaders(seq_file, convert_func, convert_args={}, out_file=None, out_a
                                      gzip_output=out_args.get('gzip_output', False))
         return handle
 
-    # Count records
-    result_count = countSeqFile(seq_file)
-
     # Set additional conversion arguments
     if convert_func in [convertGenericHeader, convertGenbankHeader]:
         convert_args.update({'delimiter': out_args['delimiter']})
@@ -84,42 +81,64 @@ def convertHeaders(seq_file, convert_func, convert_args={}, out_file=None, out_a
     # Intialize file handles
     pass_handle, fail_handle = None, None
 
+    # Hoist invariant lookups out of the record loop
+    delimiter = out_args['delimiter']
+    out_type = out_args['out_type']
+    failed = out_args['failed']
+
+    # Specialize the record formatter once instead of branching per record
+    if out_type == 'fastq':
+        def _format(label, seq, qual):  return '@%s\n%s\n+\n%s\n' % (label, seq, qual)
+    else:
+        def _format(label, seq, qual):  return formatSeqString(label, seq, None, out_type)
+
     # Iterate over sequences
     start_time = time()
     seq_count = pass_count = fail_count = 0
-    for seq in seq_iter:
+    pass_batch, fail_batch = [], []
+    for desc, seq_str, quality in seq_iter:
         # Print progress for previous iteration and update count
-        printProgress(seq_count, result_count, 0.05, start_time=start_time)
+        if seq_count % 100000 == 0:
+            printCount(seq_count, 1e5, start_time=start_time)
         seq_count += 1
 
         # Convert header
-        header = convert_func(seq.description, **convert_args)
+        header = convert_func(desc, **convert_args)
 
         if header is not None:
-            # Write successfully converted sequences
+            # Buffer successfully converted sequences
             pass_count += 1
-            seq.id = seq.name = flattenAnnotation(header, out_args['delimiter'])
-            seq.description = ''
-            try:
-                SeqIO.write(seq, pass_handle, out_args['out_type'])
-            except AttributeError:
-                # Open output file
-                pass_handle = _open('pass')
-                SeqIO.write(seq, pass_handle, out_args['out_type'])
+            label = flattenAnnotation(header, delimiter)
+            pass_batch.append(_format(label, seq_str, quality))
+            if len(pass_batch) >= 1000:
+                if pass_handle is None:  pass_handle = _open('pass')
+                pass_handle.write(''.join(pass_batch))
+                pass_batch.clear()
         else:
             fail_count += 1
-            if out_args['failed']:
-                # Write unconverted sequences
-                try:
-                    SeqIO.write(seq, fail_handle, out_args['out_type'])
-                except AttributeError:
-                    # Open output file
-                    fail_handle = _open('fail')
-                    SeqIO.write(seq, fail_handle, out_args['out_type'])
+            if failed:
+                # Buffer unconverted sequences
+                fail_batch.append(_format(desc, seq_str, quality))
+                if len(fail_batch) >= 1000:
+                    if fail_handle is None:  fail_handle = _open('fail')
+                    fail_handle.write(''.join(fail_batch))
+                    fail_batch.clear()
+
+    # Write remaining records
+    if pass_batch:
+        if pass_handle is None:  pass_handle = _open('pass')
+        pass_handle.write(''.join(pass_batch))
+    if fail_batch:
+        if fail_handle is None:  fail_handle = _open('fail')
+        fail_handle.write(''.join(fail_batch))
+
+    # Error if the input file contained no records
+    if seq_count == 0:
+        printError('File %s is empty.' % seq_file)
 
     # Print counts
-    printProgress(seq_count, result_count, 0.05, start_time=start_time)
-    log = OrderedDict()
+    printCount(seq_count, 1e5, start_time=start_time, end=True)
+    log = {}
     log['OUTPUT'] = os.path.basename(pass_handle.name) if pass_handle is not None else None
     log['SEQUENCES'] = seq_count
     log['PASS'] = pass_count
@@ -134,6 +153,21 @@ def convertHeaders(seq_file, convert_func, convert_args={}, out_file=None, out_a
     return pass_handle.name
 
 
+def convertHeadersFile(seq_file, out_file, args_dict):
+    """
+    Worker wrapper around convertHeaders for multiprocessing dispatch
+
+    Arguments:
+      seq_file : filename of the sequence file to process.
+      out_file : output file name or None.
+      args_dict : dictionary of remaining convertHeaders keyword arguments.
+
+    Returns:
+      str: the converted output file name.
+    """
+    return convertHeaders(seq_file=seq_file, out_file=out_file, **args_dict)
+
+
 def getArgParser():
     """
     Defines the ArgumentParser
@@ -169,7 +203,7 @@ def getArgParser():
     subparsers.required = True
 
     # Parent parser defining universal argument
-    parent_parser = getCommonArgParser(log=False)
+    parent_parser = getCommonArgParser(log=False, multiproc=True)
 
     # Subparser for generic header conversion
     parser_generic = subparsers.add_parser('generic', parents=[parent_parser],
@@ -252,11 +286,18 @@ if __name__ == '__main__':
                                      if k in convert_keys)
     for k in args_dict['convert_args']:  del args_dict[k]
 
-    # Calls header conversion function
+    # Calls header conversion function for each sample file
     del args_dict['seq_files']
     if 'out_files' in args_dict:  del args_dict['out_files']
-    for i, f in enumerate(args.__dict__['seq_files']):
-        args_dict['seq_file'] = f
-        args_dict['out_file'] = args.__dict__['out_files'][i] \
-            if args.__dict__['out_files'] else None
-        convertHeaders(**args_dict)
+    nproc = args_dict.pop('nproc')
+    seq_files = args.__dict__['seq_files']
+    out_files = args.__dict__['out_files'] if args.__dict__['out_files'] \
+                else [None] * len(seq_files)
+    if nproc > 1 and len(seq_files) > 1:
+        # Input files are independent, so process each file in its own worker
+        with mp.Pool(processes=min(nproc, len(seq_files))) as pool:
+            pool.starmap(partial(convertHeadersFile, args_dict=args_dict),
+                         zip(seq_files, out_files))
+    else:
+        for f, o in zip(seq_files, out_files):
+            convertHeadersFile(f, o, args_dict)
@@ -7,22 +7,37 @@ __author__ = 'Jason Anthony Vander Heiden'
 from presto import __version__, __date__
 
 # Imports
-import csv
+import multiprocessing as mp
 import os
 from argparse import ArgumentParser
-from collections import OrderedDict
+from functools import lru_cache, partial
 from textwrap import dedent
 from time import time
-from Bio import SeqIO
 
 # Presto imports
 from presto.Defaults import default_separator, default_out_args
 from presto.Commandline import CommonHelpFormatter, checkArgs, getCommonArgParser, parseCommonArgs
-from presto.Annotation import parseAnnotation, flattenAnnotation, \
+from presto.Annotation import parseAnnotation, flattenAnnotation, mergeAnnotation, \
                               addHeader, collapseHeader, copyHeader, deleteHeader, \
                               expandHeader, mergeHeader, renameHeader
-from presto.IO import getFileType, readSeqFile, countSeqFile, getOutputHandle, \
-                      openFile, printLog, printProgress
+from presto.IO import getFileType, readSeqTuples, formatSeqString, \
+                      getOutputHandle, openFile, printLog, printCount, printError
+
+
+@lru_cache(maxsize=4096)
+def parseAnnotationItems(desc, delimiter):
+    """
+    Caches parseAnnotation results for repeated description strings
+
+    Arguments:
+      desc : sequence description string.
+      delimiter : a tuple of delimiters for (fields, values, value lists).
+
+    Returns:
+      tuple: (field, value) pairs from parseAnnotation. Callers must build a
+             fresh dict from the result before modifying it.
+    """
+    return tuple(parseAnnotation(desc, delimiter=delimiter).items())
 
 
 def modifyHeaders(seq_file, modify_func, modify_args, out_file=None, out_args=default_out_args):
@@ -48,18 +63,17 @@ def modifyHeaders(seq_file, modify_func, modify_args, out_file=None, out_args=de
                 renameHeader: 'rename'}
 
     # Print parameter info
-    log = OrderedDict()
+    log = {}
     log['START'] = 'ParseHeaders'
     log['COMMAND'] = cmd_dict.get(modify_func, modify_func.__name__)
     log['FILE'] = os.path.basename(seq_file)
-    for k in sorted(modify_args):
-        v = modify_args[k]
+    for k, v in sorted(modify_args.items()):
         log[k.upper()] = ','.join(v) if isinstance(v, list) else v
     printLog(log)
 
     # Open file handles
     in_type = getFileType(seq_file)
-    seq_iter = readSeqFile(seq_file)
+    seq_iter = readSeqTuples(seq_file)
     if out_args['out_type'] is None:  out_args['out_type'] = in_type
     if out_file is not None:
         # For explicit output files, check if gzip is needed
@@ -73,31 +87,84 @@ def modifyHeaders(seq_file, modify_func, modify_args, out_file=None, out_args=de
                                      out_name=out_args['out_name'],
                                      out_type=out_args['out_type'],
                                      gzip_output=out_args.get('gzip_output', False))
-    # Count records
-    result_count = countSeqFile(seq_file)
+    # Hoist invariant lookups out of the record loop. The delimiter must be
+    # a tuple so it can serve as part of the annotation cache key.
+    delimiter = tuple(out_args['delimiter'])
+    out_type = out_args['out_type']
+
+    # Specialize the record formatter once instead of branching per record
+    if out_type == 'fastq':
+        def _format(label, seq, qual):  return '@%s\n%s\n+\n%s\n' % (label, seq, qual)
+    else:
+        def _format(label, seq, qual):  return formatSeqString(label, seq, None, out_type)
+
+    # Specialize the modify operation for the simple subcommands, avoiding
+    # per-record keyword unpacking and argument pairing in the loop. Each
+    # closure maps a parsed header directly to its output label.
+    if modify_func is deleteHeader:
+        delete_fields = modify_args['fields']
+        def _label(header):
+            for f in delete_fields:  del header[f]
+            return flattenAnnotation(header, delimiter=delimiter)
+    elif modify_func is addHeader and \
+            len(set(modify_args['fields'])) == len(modify_args['fields']):
+        add_ann = dict(zip(modify_args['fields'], modify_args['values']))
+        # Parsed header fields are always uppercase, so an uppercase key
+        # check finds every possible collision with the added fields
+        add_keys = {f.upper() for f in add_ann}
+        add_suffix = flattenAnnotation({'ID': '', **add_ann}, delimiter=delimiter)
+        def _label(header):
+            if add_keys & header.keys():
+                header = mergeAnnotation(header, add_ann, delimiter=delimiter)
+                return flattenAnnotation(header, delimiter=delimiter)
+            # Without collisions the merged label is the original label
+            # plus a constant suffix
+            return flattenAnnotation(header, delimiter=delimiter) + add_suffix
+    else:
+        def _label(header):
+            return flattenAnnotation(modify_func(header, delimiter=delimiter, **modify_args),
+                                     delimiter=delimiter)
 
     # Iterate over sequences
     start_time = time()
     seq_count = 0
-    for seq in seq_iter:
+    write_batch = []
+    # Single-entry memo for the full description to label mapping; all
+    # modify operations are deterministic in the header contents, so
+    # consecutive identical descriptions can skip the parse and flatten
+    last_desc = last_label = None
+    for desc, seq_str, quality in seq_iter:
         # Print progress for previous iteration
-        printProgress(seq_count, result_count, 0.05, start_time=start_time)
+        if seq_count % 100000 == 0:
+            printCount(seq_count, 1e5, start_time=start_time)
 
         #Update counts
         seq_count += 1
 
         # Modify header
-        header = parseAnnotation(seq.description, delimiter=out_args['delimiter'])
-        header = modify_func(header, delimiter=out_args['delimiter'], **modify_args)
+        if desc == last_desc:
+            label = last_label
+        else:
+            label = _label(dict(parseAnnotationItems(desc, delimiter)))
+            last_desc, last_label = desc, label
+
+        # Buffer new sequence and flush in batches
+        write_batch.append(_format(label, seq_str, quality))
+        if len(write_batch) >= 1000:
+            out_handle.write(''.join(write_batch))
+            write_batch.clear()
 
-        # Write new sequence
-        seq.id = seq.name = flattenAnnotation(header, delimiter=out_args['delimiter'])
-        seq.description = ''
-        SeqIO.write(seq, out_handle, out_args['out_type'])
+    # Write remaining records
+    if write_batch:
+        out_handle.write(''.join(write_batch))
+
+    # Error if the input file contained no records
+    if seq_count == 0:
+        printError('File %s is empty.' % seq_file)
 
     # print counts
-    printProgress(seq_count, result_count, 0.05, start_time=start_time)
-    log = OrderedDict()
+    printCount(seq_count, 1e5, start_time=start_time, end=True)
+    log = {}
     log['OUTPUT'] = os.path.basename(out_handle.name)
     log['SEQUENCES'] = seq_count
     log['END'] = 'ParseHeaders'
@@ -122,14 +189,14 @@ def tableHeaders(seq_file, fields, out_file=None, out_args=default_out_args):
     Returns:
       str: output table file name
     """
-    log = OrderedDict()
+    log = {}
     log['START'] = 'ParseHeaders'
     log['COMMAND'] = 'table'
     log['FILE'] = os.path.basename(seq_file)
     printLog(log)
 
     # Open file handles
-    seq_iter = readSeqFile(seq_file)
+    seq_iter = readSeqTuples(seq_file)
     if out_file is not None:
         # For explicit output files, check if gzip is needed
         if out_args.get('gzip_output', False) and not out_file.endswith('.gz'):
@@ -142,35 +209,49 @@ def tableHeaders(seq_file, fields, out_file=None, out_args=default_out_args):
                                      out_name=out_args['out_name'],
                                      out_type='tab',
                                      gzip_output=out_args.get('gzip_output', False))
-    # Count records
-    result_count = countSeqFile(seq_file)
+    # Write the header row. Annotation values are single-line by
+    # construction, so rows are joined directly without csv quoting
+    # machinery. Keep the CRLF row terminator the csv writer produced.
+    out_handle.write('\t'.join(fields) + '\r\n')
 
-    # Open csv writer and write header
-    out_writer = csv.DictWriter(out_handle, extrasaction='ignore', restval='',
-                                delimiter='\t', fieldnames=fields)
-    out_writer.writeheader()
+    # Hoist invariant lookups out of the record loop. The delimiter must be
+    # a tuple so it can serve as part of the annotation cache key.
+    delimiter = tuple(out_args['delimiter'])
 
     # Iterate over sequences
     start_time = time()
     seq_count = pass_count = fail_count = 0
-    for seq in seq_iter:
+    write_batch = []
+    for desc, seq_str, quality in seq_iter:
         # Print progress for previous iteration
-        printProgress(seq_count, result_count, 0.05, start_time=start_time)
+        if seq_count % 100000 == 0:
+            printCount(seq_count, 1e5, start_time=start_time)
 
         # Get annotations
         seq_count += 1
-        ann = parseAnnotation(seq.description, fields, delimiter=out_args['delimiter'])
+        ann = dict(parseAnnotationItems(desc, delimiter))
 
-        # Write records
-        if ann:
+        # Buffer rows and flush in batches
+        if any(f in ann for f in fields):
             pass_count += 1
-            out_writer.writerow(ann)
+            write_batch.append('\t'.join(ann.get(f, '') for f in fields) + '\r\n')
+            if len(write_batch) >= 1000:
+                out_handle.write(''.join(write_batch))
+                write_batch.clear()
         else:
             fail_count += 1
 
+    # Write remaining rows
+    if write_batch:
+        out_handle.write(''.join(write_batch))
+
+    # Error if the input file contained no records
+    if seq_count == 0:
+        printError('File %s is empty.' % seq_file)
+
     # Print counts
-    printProgress(seq_count, result_count, 0.05, start_time=start_time)
-    log = OrderedDict()
+    printCount(seq_count, 1e5, start_time=start_time, end=True)
+    log = {}
     log['OUTPUT'] = os.path.basename(out_handle.name)
     log['SEQUENCES'] = seq_count
     log['PASS'] = pass_count
@@ -184,6 +265,22 @@ def tableHeaders(seq_file, fields, out_file=None, out_args=default_out_args):
     return out_handle.name
 
 
+def processHeadersFile(seq_file, out_file, func, args_dict):
+    """
+    Worker wrapper around the header operations for multiprocessing dispatch
+
+    Arguments:
+      seq_file : filename of the sequence file to process.
+      out_file : output file name or None.
+      func : the header operation; modifyHeaders or tableHeaders.
+      args_dict : dictionary of remaining keyword arguments for func.
+
+    Returns:
+      str: the output file name.
+    """
+    return func(seq_file=seq_file, out_file=out_file, **args_dict)
+
+
 def getArgParser():
     """
     Defines the ArgumentParser
@@ -220,7 +317,7 @@ def getArgParser():
     subparsers.required = True
 
     # Subparser to add header fields
-    parser_add = subparsers.add_parser('add', parents=[getCommonArgParser(log=False)],
+    parser_add = subparsers.add_parser('add', parents=[getCommonArgParser(log=False, multiproc=True)],
                                        formatter_class=CommonHelpFormatter, add_help=False,
                                        help='Adds field/value pairs to header annotations',
                                        description='Adds field/value pairs to header annotations')
@@ -233,7 +330,7 @@ def getArgParser():
     parser_add.set_defaults(modify_func=addHeader)
 
     # Subparser to collapse header fields
-    parser_collapse = subparsers.add_parser('collapse', parents=[getCommonArgParser(log=False)],
+    parser_collapse = subparsers.add_parser('collapse', parents=[getCommonArgParser(log=False, multiproc=True)],
                                             formatter_class=CommonHelpFormatter, add_help=False,
                                             help='Collapses header annotations with multiple entries',
                                             description='Collapses header annotations with multiple entries')
@@ -255,7 +352,7 @@ def getArgParser():
     parser_collapse.set_defaults(modify_func=collapseHeader)
 
     # Subparser to copy header fields
-    parser_copy = subparsers.add_parser('copy', parents=[getCommonArgParser(log=False)],
+    parser_copy = subparsers.add_parser('copy', parents=[getCommonArgParser(log=False, multiproc=True)],
                                         formatter_class=CommonHelpFormatter, add_help=False,
                                         help='Copies header annotation fields',
                                         description='Copies header annotation fields')
@@ -282,7 +379,7 @@ def getArgParser():
     parser_copy.set_defaults(modify_func=copyHeader)
 
     # Subparser to delete header fields
-    parser_delete = subparsers.add_parser('delete', parents=[getCommonArgParser(log=False)],
+    parser_delete = subparsers.add_parser('delete', parents=[getCommonArgParser(log=False, multiproc=True)],
                                           formatter_class=CommonHelpFormatter, add_help=False,
                                           help='Deletes fields from header annotations',
                                           description='Deletes fields from header annotations')
@@ -293,7 +390,7 @@ def getArgParser():
     parser_delete.set_defaults(modify_func=deleteHeader)
 
     # Subparser to expand header fields
-    parser_expand = subparsers.add_parser('expand', parents=[getCommonArgParser(log=False)],
+    parser_expand = subparsers.add_parser('expand', parents=[getCommonArgParser(log=False, multiproc=True)],
                                           formatter_class=CommonHelpFormatter, add_help=False,
                                           help='Expands annotation fields with multiple values',
                                           description='Expands annotation fields with multiple values')
@@ -307,7 +404,7 @@ def getArgParser():
     parser_expand.set_defaults(modify_func=expandHeader)
 
     # Subparser to merge header fields
-    parser_merge = subparsers.add_parser('merge', parents=[getCommonArgParser(log=False)],
+    parser_merge = subparsers.add_parser('merge', parents=[getCommonArgParser(log=False, multiproc=True)],
                                         formatter_class=CommonHelpFormatter, add_help=False,
                                         help='Merge multiple annotations fields into a single field',
                                         description='Merge multiple annotations fields into a single field')
@@ -334,7 +431,7 @@ def getArgParser():
     parser_merge.set_defaults(modify_func=mergeHeader)
 
     # Subparser to rename header fields
-    parser_rename = subparsers.add_parser('rename', parents=[getCommonArgParser(log=False)],
+    parser_rename = subparsers.add_parser('rename', parents=[getCommonArgParser(log=False, multiproc=True)],
                                           formatter_class=CommonHelpFormatter, add_help=False,
                                           help='Renames header annotation fields',
                                           description='Renames header annotation fields')
@@ -361,7 +458,7 @@ def getArgParser():
     parser_rename.set_defaults(modify_func=renameHeader)
 
     # Subparser to create a header table
-    parser_table = subparsers.add_parser('table', parents=[getCommonArgParser(seq_out=False, log=False)],
+    parser_table = subparsers.add_parser('table', parents=[getCommonArgParser(seq_out=False, log=False, multiproc=True)],
                                          formatter_class=CommonHelpFormatter, add_help=False,
                                          help='Writes sequence headers to a table',
                                          description='Writes sequence headers to a table')
@@ -386,7 +483,7 @@ if __name__ == '__main__':
 
     # Convert case of fields
     if 'fields' in args_dict and args_dict['fields']:
-        args_dict['fields'] = list(map(str.upper, args_dict['fields']))
+        args_dict['fields'] = [f.upper() for f in args_dict['fields']]
 
     # Built modify_args dictionary
     if args.func == modifyHeaders:
@@ -397,14 +494,14 @@ if __name__ == '__main__':
             modify_args['fields'] = args_dict.pop('fields')
         if 'action' in args_dict:
             modify_args['action'] = args_dict.pop('action') if args_dict['action'] is None \
-                                    else str.lower(args_dict.pop('action'))
+                                    else args_dict.pop('action').lower()
         if 'actions' in args_dict:
             modify_args['actions'] = args_dict.pop('actions') if args_dict['actions'] is None \
-                                     else list(map(str.lower, args_dict.pop('actions')))
+                                     else [a.lower() for a in args_dict.pop('actions')]
         if 'name' in args_dict:
-            modify_args['name'] = str.upper(args_dict.pop('name'))
+            modify_args['name'] = args_dict.pop('name').upper()
         if 'names' in args_dict:
-            modify_args['names'] = list(map(str.upper, args_dict.pop('names')))
+            modify_args['names'] = [n.upper() for n in args_dict.pop('names')]
         if 'values' in args_dict:
             modify_args['values'] = args_dict.pop('values')
         if 'separator' in args_dict:
@@ -424,13 +521,20 @@ if __name__ == '__main__':
         if modify_args['actions'] is not None and len(modify_args['actions']) != len(modify_args['names']):
             parser.error('You must specify exactly one action (--act) per new name (-k)')
 
-    # Calls header processing function
+    # Calls header processing function for each sample file
     del args_dict['command']
     del args_dict['func']
     del args_dict['seq_files']
     if 'out_files' in args_dict:  del args_dict['out_files']
-    for i, f in enumerate(args.__dict__['seq_files']):
-        args_dict['seq_file'] = f
-        args_dict['out_file'] = args.__dict__['out_files'][i] \
-            if args.__dict__['out_files'] else None
-        args.func(**args_dict)
+    nproc = args_dict.pop('nproc')
+    seq_files = args.__dict__['seq_files']
+    out_files = args.__dict__['out_files'] if args.__dict__['out_files'] \
+                else [None] * len(seq_files)
+    if nproc > 1 and len(seq_files) > 1:
+        # Input files are independent, so process each file in its own worker
+        with mp.Pool(processes=min(nproc, len(seq_files))) as pool:
+            pool.starmap(partial(processHeadersFile, func=args.func, args_dict=args_dict),
+                         zip(seq_files, out_files))
+    else:
+        for f, o in zip(seq_files, out_files):
+            processHeadersFile(f, o, args.func, args_dict)
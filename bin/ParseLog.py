@@ -7,15 +7,15 @@ __author__ = 'Jason Anthony Vander Heiden'
 
 # Imports
 import csv
+import multiprocessing as mp
 import os
 from argparse import ArgumentParser
-from collections import OrderedDict
+from functools import partial
 from textwrap import dedent
 from time import time
 
 # Presto imports
 from presto.Defaults import default_out_args
-from presto.Annotation import parseLog
 from presto.Commandline import CommonHelpFormatter, checkArgs, getCommonArgParser, parseCommonArgs
 from presto.IO import getOutputHandle, openFile, printLog, printCount
 
@@ -33,7 +33,7 @@ def tableLog(record_file, fields, out_file=None, out_args=default_out_args):
     Returns:
       str: the output table file name
     """
-    log = OrderedDict()
+    log = {}
     log['START'] = 'ParseLog'
     log['FILE'] = os.path.basename(record_file)
     printLog(log)
@@ -53,49 +53,81 @@ def tableLog(record_file, fields, out_file=None, out_args=default_out_args):
                                       out_type='tab',
                                       gzip_output=out_args.get('gzip_output', False))
 
-    # Open csv writer and write header
-    out_writer = csv.DictWriter(out_handle, extrasaction='ignore', restval='',
-                                delimiter='\t', fieldnames=fields)
-    out_writer.writeheader()
-
-    # Iterate over log records
+    # Open csv writer and write header; rows are written as lists in
+    # field order, which avoids DictWriter's per-row column reordering
+    out_writer = csv.writer(out_handle, delimiter='\t')
+    out_writer.writerow(fields)
+
+    # Parse only the requested fields out of a record block; the flag
+    # reports whether the block contained any field line at all
+    fields_set = frozenset(fields)
+    def _parseRecord(record):
+        record_dict = {}
+        seen = False
+        for line in record.split('\n'):
+            # A field line contains exactly one '> ' marker followed by a
+            # non-empty value; strip only the padded key and value ends
+            # instead of making a full pass over the line first
+            field, sep, value = line.partition('> ')
+            if sep:
+                value = value.rstrip()
+                if value and '> ' not in value:
+                    seen = True
+                    field = field.lstrip()
+                    if field in fields_set:
+                        record_dict[field] = value
+        return record_dict, seen
+
+    # Iterate over log records in bulk chunks split on the empty lines
+    # separating records (see printLog), rather than accumulating records
+    # one line at a time
     start_time = time()
-    record = ''
     rec_count = pass_count = fail_count = 0
-    for line in log_handle:
-        if line.strip() == '' and record:
+    row_batch = []
+    tail = ''
+    chunk = log_handle.read(2 ** 20)
+    while chunk:
+        records = (tail + chunk).split('\n\n')
+        # The last block may continue in the next chunk
+        tail = records.pop()
+        for record in records:
+            if not record:  continue
+
             # Print progress for previous iteration
             printCount(rec_count, 1e5, start_time=start_time)
 
             # Parse record block
             rec_count += 1
-            record_dict = parseLog(record)
-
-            # Write records
-            if any([f in fields for f in record_dict]):
-                pass_count += 1
-                out_writer.writerow(record_dict)
-            elif record_dict:
-                fail_count += 1
+            record_dict, record_seen = _parseRecord(record)
 
-            # Empty record string
-            record = ''
-        else:
-            # Append to record
-            record += line
-    else:
-        # Write final record
-        if record:
-            record_dict = parseLog(record)
-            if any([f in fields for f in record_dict]):
+            # Buffer rows and flush in batches
+            if record_dict:
                 pass_count += 1
-                out_writer.writerow(record_dict)
-            elif record_dict:
+                row_batch.append([record_dict.get(f, '') for f in fields])
+                if len(row_batch) >= 1000:
+                    out_writer.writerows(row_batch)
+                    row_batch.clear()
+            elif record_seen:
                 fail_count += 1
+        chunk = log_handle.read(2 ** 20)
+
+    # Parse final record
+    if tail.strip():
+        rec_count += 1
+        record_dict, record_seen = _parseRecord(tail)
+        if record_dict:
+            pass_count += 1
+            row_batch.append([record_dict.get(f, '') for f in fields])
+        elif record_seen:
+            fail_count += 1
+
+    # Write remaining rows
+    if row_batch:
+        out_writer.writerows(row_batch)
 
     # Print counts
     printCount(rec_count, 1e5, start_time, end=True)
-    log = OrderedDict()
+    log = {}
     log['OUTPUT'] = os.path.basename(out_handle.name)
     log['RECORDS'] = rec_count
     log['PASS'] = pass_count
@@ -110,6 +142,21 @@ def tableLog(record_file, fields, out_file=None, out_args=default_out_args):
     return log_handle.name
 
 
+def tableLogFile(record_file, out_file, args_dict):
+    """
+    Worker wrapper around tableLog for multiprocessing dispatch
+
+    Arguments:
+      record_file : filename of the log file to process.
+      out_file : output file name or None.
+      args_dict : dictionary of remaining tableLog keyword arguments.
+
+    Returns:
+      str: the output table file name.
+    """
+    return tableLog(record_file=record_file, out_file=out_file, **args_dict)
+
+
 def getArgParser():
     """
     Defines the ArgumentParser
@@ -132,7 +179,8 @@ def getArgParser():
     # Define ArgumentParser
     parser = ArgumentParser(description=__doc__, epilog=fields,
                             parents=[getCommonArgParser(seq_in=False, seq_out=False,
-                                                        failed=False, log=False)],
+                                                        failed=False, log=False,
+                                                        multiproc=True)],
                             formatter_class=CommonHelpFormatter, add_help=False)
 
     group_log = parser.add_argument_group('parsing arguments')
@@ -160,8 +208,15 @@ if __name__ == '__main__':
     # Call parseLog for each log file
     del args_dict['record_files']
     if 'out_files' in args_dict:  del args_dict['out_files']
-    for i, f in enumerate(args.__dict__['record_files']):
-        args_dict['record_file'] = f
-        args_dict['out_file'] = args.__dict__['out_files'][i] \
-            if args.__dict__['out_files'] else None
-        tableLog(**args_dict)
+    nproc = args_dict.pop('nproc')
+    record_files = args.__dict__['record_files']
+    out_files = args.__dict__['out_files'] if args.__dict__['out_files'] \
+                else [None] * len(record_files)
+    if nproc > 1 and len(record_files) > 1:
+        # Input files are independent, so process each file in its own worker
+        with mp.Pool(processes=min(nproc, len(record_files))) as pool:
+            pool.starmap(partial(tableLogFile, args_dict=args_dict),
+                         zip(record_files, out_files))
+    else:
+        for f, o in zip(record_files, out_files):
+            tableLogFile(f, o, args_dict)
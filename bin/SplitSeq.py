@@ -7,12 +7,13 @@ __author__ = 'Jason Anthony Vander Heiden'
 from presto import __version__, __date__
 
 # Imports
+import mmap
 import os
 import random
+import shutil
 import sys
 import csv
 from argparse import ArgumentParser
-from collections import OrderedDict
 from operator import xor
 from textwrap import dedent
 from time import time
@@ -22,9 +23,78 @@ from Bio import SeqIO
 from presto.Defaults import choices_coord, default_coord, default_out_args
 from presto.Commandline import CommonHelpFormatter, checkArgs, getCommonArgParser, parseCommonArgs
 from presto.Sequence import indexSeqSets, subsetSeqIndex
-from presto.Annotation import parseAnnotation, getAnnotationValues, getCoordKey
-from presto.IO import getFileType, readSeqFile, countSeqFile, getOutputHandle, \
-                      openFile, printLog, printMessage, printProgress, printCount, printWarning, printError
+from presto.Annotation import parseAnnotation, getCoordKey
+from presto.IO import getFileType, readSeqFile, readSeqTuples, readSeqBlocks, readSeqOffsets, \
+                      formatSeqString, \
+                      getOutputHandle, openFile, printLog, printMessage, \
+                      printProgress, printCount, printWarning, printError
+
+
+def _fieldExtractor(field, delimiter):
+    """
+    Builds a fast single-field annotation extractor
+
+    Arguments:
+      field : the annotation field to extract.
+      delimiter : a tuple of delimiters for (fields, values, value lists).
+
+    Returns:
+      function : a function mapping a description string to the field value,
+                 equivalent to parseAnnotation(desc, delimiter=delimiter)[field]
+                 without building the full annotation dictionary.
+    """
+    marker = ('%s%s%s' % (delimiter[0], field, delimiter[1])).upper()
+    end_char = delimiter[0]
+
+    def _extract(desc):
+        # Field names are case-insensitive (parseAnnotation uppercases
+        # them), so search an uppercased copy of the description and from
+        # the right, which resolves repeated fields last-value-wins like
+        # parseAnnotation; values keep their original case. Fall back to
+        # the full parse when the field is absent from the description
+        i = desc.upper().rfind(marker)
+        if i < 0:
+            return parseAnnotation(desc, delimiter=delimiter)[field]
+        i += len(marker)
+        j = desc.find(end_char, i)
+        return desc[i:j] if j >= 0 else desc[i:]
+
+    return _extract
+
+
+def _indexedWriter(seq_file, out_type, key_func=None):
+    """
+    Builds a random access index and batch writer for a sequence file
+
+    Arguments:
+      seq_file : filename of the sequence file to index.
+      out_type : the output file type records will be written as.
+      key_func : the function to convert sequence identifiers to index keys.
+
+    Returns:
+      tuple : a (seq_dict, write) tuple, where seq_dict maps keys to records
+              and write(keys, handle) writes the selected records to an
+              open output handle.
+    """
+    in_type = getFileType(seq_file)
+    # Index records as raw byte ranges when they are copied unmodified;
+    # compressed input or format conversion falls back to the SeqRecord index
+    if out_type == in_type and not seq_file.endswith('.gz') \
+            and os.path.getsize(seq_file) > 0:
+        seq_dict = readSeqOffsets(seq_file, key_func=key_func)
+        # Map the file once; record copies become slices of the page cache
+        with open(seq_file, 'rb') as in_handle:
+            seq_map = mmap.mmap(in_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        def _write(keys, handle):
+            for k in keys:
+                rec = seq_dict[k]
+                handle.write(seq_map[rec.start:rec.start + rec.length].decode())
+    else:
+        seq_dict = readSeqFile(seq_file, index=True, key_func=key_func)
+        def _write(keys, handle):
+            SeqIO.write([seq_dict[k] for k in keys], handle, out_type)
+
+    return seq_dict, _write
 
 
 def downsizeSeqFile(seq_file, max_count, out_args=default_out_args):
@@ -39,7 +109,7 @@ def downsizeSeqFile(seq_file, max_count, out_args=default_out_args):
     Returns:
       list: output file names
     """
-    log = OrderedDict()
+    log = {}
     log['START'] = 'SplitSeq'
     log['COMMAND'] = 'count'
     log['FILE'] = os.path.basename(seq_file)
@@ -48,46 +118,73 @@ def downsizeSeqFile(seq_file, max_count, out_args=default_out_args):
 
     # Open file handles
     in_type = getFileType(seq_file)
-    seq_iter = readSeqFile(seq_file)
     if out_args['out_type'] is None:  out_args['out_type'] = in_type
-    # Determine total numbers of records
-    rec_count = countSeqFile(seq_file)
+
+    # Copy records through unparsed when they are not reformatted;
+    # compressed input or format conversion falls back to parsed records
+    out_type = out_args['out_type']
+    if out_type == in_type and not seq_file.endswith('.gz'):
+        rec_iter = readSeqBlocks(seq_file)
+    else:
+        if out_type == 'fastq':
+            def _format(label, seq, qual):  return '@%s\n%s\n+\n%s\n' % (label, seq, qual)
+        else:
+            def _format(label, seq, qual):  return formatSeqString(label, seq, None, out_type)
+        rec_iter = (_format(*t) for t in readSeqTuples(seq_file))
 
     # Loop through iterator writing each record and opening new output handle as needed
     start_time = time()
     seq_count, part_num = 0, 1
-    out_handle = getOutputHandle(seq_file, 'part%06i' % part_num, out_dir=out_args['out_dir'],
+    # Bind the label formatter once; the format spec is parsed per call otherwise
+    _part_label = 'part{:06d}'.format
+    out_handle = getOutputHandle(seq_file, _part_label(part_num), out_dir=out_args['out_dir'],
                                  out_name=out_args['out_name'], out_type=out_args['out_type'],
                                  gzip_output=out_args.get('gzip_output', False))
     out_files = [out_handle.name]
-    for seq in seq_iter:
+    write_batch = []
+    for record in rec_iter:
         # Print progress for previous iteration
-        printProgress(seq_count, rec_count, 0.05, start_time=start_time)
-
-        # Update count
-        seq_count += 1
-
-        # Write records
-        SeqIO.write(seq, out_handle, out_args['out_type'])
-        # Break if total records reached to avoid extra empty file
-        if seq_count == rec_count:
-            break
-
-        # Open new file if needed
-        if seq_count % max_count == 0:
+        printCount(seq_count, 1e5, start_time=start_time)
+
+        # Open new file if needed; rotating before the write avoids a
+        # trailing empty file without knowing the record total upfront
+        if seq_count and seq_count % max_count == 0:
+            if write_batch:
+                out_handle.write(''.join(write_batch))
+                write_batch.clear()
             out_handle.close()
             part_num += 1
-            out_handle = getOutputHandle(seq_file, 'part%06i' % part_num, out_dir=out_args['out_dir'],
+            out_handle = getOutputHandle(seq_file, _part_label(part_num), out_dir=out_args['out_dir'],
                                          out_name=out_args['out_name'], out_type=out_args['out_type'],
                                          gzip_output=out_args.get('gzip_output', False))
             out_files.append(out_handle.name)
 
+        # Update count
+        seq_count += 1
+
+        # Buffer records and flush in batches
+        write_batch.append(record)
+        if len(write_batch) >= 1000:
+            out_handle.write(''.join(write_batch))
+            write_batch.clear()
+
+    # Write remaining records
+    if write_batch:
+        out_handle.write(''.join(write_batch))
+
+    # Error if the input file contained no records, removing the part
+    # file opened before the read loop
+    if seq_count == 0:
+        out_handle.close()
+        os.remove(out_handle.name)
+        printError('File %s is empty.' % seq_file)
+
     # Print log
-    printProgress(seq_count, rec_count, 0.05, start_time=start_time)
-    log = OrderedDict()
+    printCount(seq_count, 1e5, start_time=start_time, end=True)
+    log = {}
     for i, f in enumerate(out_files):
         log['OUTPUT%i' % (i + 1)] = os.path.basename(f)
-    log['SEQUENCES'] = rec_count
+    log['SEQUENCES'] = seq_count
     log['PARTS'] = len(out_files)
     log['END'] = 'SplitSeq'
     printLog(log)
@@ -112,7 +209,7 @@ def groupSeqFile(seq_file, field, threshold=None, out_args=default_out_args):
     Returns:
       list: output file names
     """
-    log = OrderedDict()
+    log = {}
     log['START'] = 'SplitSeq'
     log['COMMAND'] = 'group'
     log['FILE'] = os.path.basename(seq_file)
@@ -122,85 +219,108 @@ def groupSeqFile(seq_file, field, threshold=None, out_args=default_out_args):
 
     # Open file handles
     in_type = getFileType(seq_file)
-    seq_iter = readSeqFile(seq_file)
+    seq_iter = readSeqTuples(seq_file)
     if out_args['out_type'] is None:  out_args['out_type'] = in_type
 
-    # Determine total numbers of records
-    rec_count = countSeqFile(seq_file)
+    # Specialize the record formatter once instead of branching per record
+    out_type = out_args['out_type']
+    if out_type == 'fastq':
+        def _format(label, seq, qual):  return '@%s\n%s\n+\n%s\n' % (label, seq, qual)
+    else:
+        def _format(label, seq, qual):  return formatSeqString(label, seq, None, out_type)
 
     # Process sequences
     start_time = time()
     seq_count = 0
+    _extract = _fieldExtractor(field, out_args['delimiter'])
     if threshold is None:
-        # Sort records into files based on textual field
-        # Create set of unique field tags
-        temp_iter = readSeqFile(seq_file)
-        tag_list = getAnnotationValues(temp_iter, field, unique=True, delimiter=out_args['delimiter'])
-
+        # Sort records into files based on textual field in a single pass,
+        # opening each output handle on first sight of a new tag
         if sys.platform != 'win32':
             import resource
-            # Increase open file handle limit if needed
             file_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
-            file_count = len(tag_list) + 256
-            if file_limit < file_count and file_count <= 8192:
-                #print file_limit, file_count
-                resource.setrlimit(resource.RLIMIT_NOFILE, (file_count, file_count))
-            elif file_count > 8192:
-                e = '''OS file limit would need to be set to %i.
-                    If you are sure you want to do this, then increase the
-                    file limit in the OS (via ulimit) and rerun this tool.
-                    ''' % file_count
-                printError(dedent(e))
-
-        # Create output handles
-        # out_label = '%s=%s' % (field, tag)
-        handles_dict = {tag:getOutputHandle(seq_file,
-                                            '%s-%s' % (field, tag),
-                                            out_dir=out_args['out_dir'],
-                                            out_name=out_args['out_name'],
-                                            out_type=out_args['out_type'],
-                                            gzip_output=out_args.get('gzip_output', False))
-                        for tag in tag_list}
-
-        # Iterate over sequences
-        for seq in seq_iter:
-            printProgress(seq_count, rec_count, 0.05, start_time=start_time)
+        else:
+            file_limit = None
+
+        handles_dict = {}
+        batch_dict = {}
+        for desc, seq_str, quality in seq_iter:
+            printCount(seq_count, 1e5, start_time=start_time)
             seq_count += 1
-            # Write sequences
-            tag = parseAnnotation(seq.description, delimiter=out_args['delimiter'])[field]
-            SeqIO.write(seq, handles_dict[tag], out_args['out_type'])
+            # Buffer sequences
+            tag = _extract(desc)
+            batch = batch_dict.get(tag)
+            if batch is None:
+                # Increase open file handle limit if needed
+                file_count = len(handles_dict) + 257
+                if file_limit is not None and file_limit < file_count:
+                    if file_count <= 8192:
+                        resource.setrlimit(resource.RLIMIT_NOFILE, (file_count, file_count))
+                        file_limit = file_count
+                    else:
+                        e = '''OS file limit would need to be set to %i.
+                            If you are sure you want to do this, then increase the
+                            file limit in the OS (via ulimit) and rerun this tool.
+                            ''' % file_count
+                        printError(dedent(e))
+                # out_label = '%s=%s' % (field, tag)
+                handles_dict[tag] = getOutputHandle(seq_file,
+                                                    '%s-%s' % (field, tag),
+                                                    out_dir=out_args['out_dir'],
+                                                    out_name=out_args['out_name'],
+                                                    out_type=out_args['out_type'],
+                                                    gzip_output=out_args.get('gzip_output', False))
+                batch = batch_dict[tag] = []
+            batch.append(_format(desc, seq_str, quality))
+            if len(batch) >= 1000:
+                handles_dict[tag].write(''.join(batch))
+                batch.clear()
+
+        # Write remaining records
+        for tag, batch in batch_dict.items():
+            if batch:  handles_dict[tag].write(''.join(batch))
     else:
-        # Sort records into files based on numeric threshold
+        # Sort records into files based on numeric threshold, opening each
+        # output handle on first sight of its group so an empty group does
+        # not leave an empty file behind
         threshold = float(threshold)
-        # Create output handles
-        handles_dict = {'under':getOutputHandle(seq_file,
-                                                'under-%.1g' % threshold,
-                                                out_dir=out_args['out_dir'],
-                                                out_name=out_args['out_name'],
-                                                out_type=out_args['out_type'],
-                                                gzip_output=out_args.get('gzip_output', False)),
-                        'atleast':getOutputHandle(seq_file,
-                                                  'atleast-%.1g' % threshold,
-                                                  out_dir=out_args['out_dir'],
-                                                  out_name=out_args['out_name'],
-                                                  out_type=out_args['out_type'],
-                                                  gzip_output=out_args.get('gzip_output', False))}
-
-        # Iterate over sequences
-        for seq in seq_iter:
-            printProgress(seq_count, rec_count, 0.05, start_time=start_time)
+
+        handles_dict = {}
+        batch_dict = {}
+        for desc, seq_str, quality in seq_iter:
+            printCount(seq_count, 1e5, start_time=start_time)
             seq_count += 1
-            # Write sequences
-            tag = parseAnnotation(seq.description, delimiter=out_args['delimiter'])[field]
-            tag = 'under' if float(tag) < threshold else 'atleast'
-            SeqIO.write(seq, handles_dict[tag], out_args['out_type'])
+            # Buffer sequences
+            tag = 'under' if float(_extract(desc)) < threshold else 'atleast'
+            batch = batch_dict.get(tag)
+            if batch is None:
+                handles_dict[tag] = getOutputHandle(seq_file,
+                                                    '%s-%.1g' % (tag, threshold),
+                                                    out_dir=out_args['out_dir'],
+                                                    out_name=out_args['out_name'],
+                                                    out_type=out_args['out_type'],
+                                                    gzip_output=out_args.get('gzip_output', False))
+                batch = batch_dict[tag] = []
+            batch.append(_format(desc, seq_str, quality))
+            if len(batch) >= 1000:
+                handles_dict[tag].write(''.join(batch))
+                batch.clear()
+
+        # Write remaining records
+        for tag, batch in batch_dict.items():
+            if batch:  handles_dict[tag].write(''.join(batch))
+
+    # Error if the input file contained no records; handles are opened
+    # lazily, so no output files exist yet
+    if seq_count == 0:
+        printError('File %s is empty.' % seq_file)
 
     # Print log
-    printProgress(seq_count, rec_count, 0.05, start_time=start_time)
-    log = OrderedDict()
+    printCount(seq_count, 1e5, start_time=start_time, end=True)
+    log = {}
     for i, k in enumerate(handles_dict):
         log['OUTPUT%i' % (i + 1)] = os.path.basename(handles_dict[k].name)
-    log['SEQUENCES'] = rec_count
+    log['SEQUENCES'] = seq_count
     log['PARTS'] = len(handles_dict)
     log['END'] = 'SplitSeq'
     printLog(log)
@@ -229,7 +349,7 @@ def sampleSeqFile(seq_file, max_count, field=None, values=None, out_args=default
     def _sample_list(n, index_list):
         max_n = len(index_list)
         r = random.sample(range(max_n), n) if n < max_n else range(max_n)
-        return [index_list[x] for x in r]
+        return list(map(index_list.__getitem__, r))
 
     # Function to sample from a dictionary of grouped sequence indices
     def _sample_dict(n, index_dict):
@@ -237,11 +357,11 @@ def sampleSeqFile(seq_file, max_count, field=None, values=None, out_args=default
         for v in index_dict.values():
             max_n = len(v)
             r = random.sample(range(max_n), n) if n < max_n else range(max_n)
-            sample_list.extend([v[x] for x in r])
+            sample_list.extend(map(v.__getitem__, r))
         return sample_list
 
     # Print console log
-    log = OrderedDict()
+    log = {}
     log['START'] = 'SplitSeq'
     log['COMMAND'] = 'sample'
     log['FILE'] = os.path.basename(seq_file)
@@ -255,9 +375,15 @@ def sampleSeqFile(seq_file, max_count, field=None, values=None, out_args=default
     printMessage('Reading files', start_time=start_time, width=25)
 
     in_type = getFileType(seq_file)
-    seq_dict = readSeqFile(seq_file, index=True)
     if out_args['out_type'] is None:  out_args['out_type'] = in_type
 
+    seq_dict, _write = _indexedWriter(seq_file, out_args['out_type'])
+
+    # A full-size unfiltered sample keeps every record in file order, so it
+    # can stream the raw bytes instead of writing records through the index
+    _copy_all = field is None and out_args['out_type'] == in_type \
+                and not seq_file.endswith('.gz')
+
     # Generate subset of records
     if field is not None and values is not None:
         _sample = _sample_list
@@ -279,8 +405,12 @@ def sampleSeqFile(seq_file, max_count, field=None, values=None, out_args=default
         start_time = time()
         printMessage('Sampling n=%i' % n, start_time=start_time, width=25)
         # Sample from records
-        sample_keys = _sample(n, seq_index)
-        sample_count = len(sample_keys)
+        if _copy_all and n >= len(seq_index):
+            sample_keys = None
+            sample_count = len(seq_index)
+        else:
+            sample_keys = _sample(n, seq_index)
+            sample_count = len(sample_keys)
 
         # Write sampled sequences to files
         with getOutputHandle(seq_file,
@@ -289,14 +419,17 @@ def sampleSeqFile(seq_file, max_count, field=None, values=None, out_args=default
                              out_name=out_args['out_name'],
                              out_type=out_args['out_type'],
                              gzip_output=out_args.get('gzip_output', False)) as out_handle:
-            for k in sample_keys:
-                SeqIO.write(seq_dict[k], out_handle, out_args['out_type'])
+            if sample_keys is None:
+                with open(seq_file, 'r') as in_handle:
+                    shutil.copyfileobj(in_handle, out_handle, 2 ** 20)
+            else:
+                _write(sample_keys, out_handle)
             out_files.append(out_handle.name)
 
         printMessage('Done', start_time=start_time, end=True, width=25)
 
         # Print log for iteration
-        log = OrderedDict()
+        log = {}
         log['MAX_COUNT'] = n
         log['SAMPLED'] = sample_count
         log['OUTPUT'] = os.path.basename(out_files[i])
@@ -305,7 +438,7 @@ def sampleSeqFile(seq_file, max_count, field=None, values=None, out_args=default
 
 
     # Print log
-    log = OrderedDict()
+    log = {}
     log['END'] = 'SplitSeq'
     printLog(log)
 
@@ -350,7 +483,7 @@ def samplePairSeqFile(seq_file_1, seq_file_2, max_count, field=None, values=None
         return sample_list
 
     # Print console log
-    log = OrderedDict()
+    log = {}
     log['START']= 'SplitSeq'
     log['COMMAND'] = 'samplepair'
     log['FILE1'] = os.path.basename(seq_file_1)
@@ -380,8 +513,8 @@ def samplePairSeqFile(seq_file_1, seq_file_2, max_count, field=None, values=None
     start_time = time()
     printMessage('Reading files', start_time=start_time, width=25)
 
-    seq_dict_1 = readSeqFile(seq_file_1, index=True, key_func=_key_func)
-    seq_dict_2 = readSeqFile(seq_file_2, index=True, key_func=_key_func)
+    seq_dict_1, _write_1 = _indexedWriter(seq_file_1, out_type_1, key_func=_key_func)
+    seq_dict_2, _write_2 = _indexedWriter(seq_file_2, out_type_2, key_func=_key_func)
 
     # Subset keys to those meeting field/value criteria
     if field is not None and values is not None:
@@ -427,14 +560,13 @@ def samplePairSeqFile(seq_file_1, seq_file_2, max_count, field=None, values=None
                                        gzip_output=out_args.get('gzip_output', False))
         out_files.append((out_handle_1.name, out_handle_2.name))
 
-        for k in sample_keys:
-            SeqIO.write(seq_dict_1[k], out_handle_1, out_type_1)
-            SeqIO.write(seq_dict_2[k], out_handle_2, out_type_2)
+        _write_1(sample_keys, out_handle_1)
+        _write_2(sample_keys, out_handle_2)
 
         printMessage('Done', start_time=start_time, end=True, width=25)
 
         # Print log for iteration
-        log = OrderedDict()
+        log = {}
         log['MAX_COUNT'] = n
         log['SAMPLED'] = sample_count
         log['OUTPUT1'] = os.path.basename(out_files[i][0])
@@ -446,7 +578,7 @@ def samplePairSeqFile(seq_file_1, seq_file_2, max_count, field=None, values=None
         out_handle_2.close()
 
     # Print log
-    log = OrderedDict()
+    log = {}
     log['END'] = 'SplitSeq'
     printLog(log)
 
@@ -469,7 +601,7 @@ def sortSeqFile(seq_file, field, numeric=False, max_count=None, out_args=default
     Returns:
       list: output file names
     """
-    log = OrderedDict()
+    log = {}
     log['START'] = 'SplitSeq'
     log['COMMAND'] = 'sort'
     log['FILE'] = os.path.basename(seq_file)
@@ -480,14 +612,21 @@ def sortSeqFile(seq_file, field, numeric=False, max_count=None, out_args=default
 
     # Open file handles
     in_type = getFileType(seq_file)
-    seq_dict = readSeqFile(seq_file, index=True)
     if out_args['out_type'] is None:  out_args['out_type'] = in_type
 
+    seq_dict, _write = _indexedWriter(seq_file, out_args['out_type'])
+
     # Get annotations and sort seq_dict by annotation values
-    tag_dict = {k:parseAnnotation(seq_dict[k].description, delimiter=out_args['delimiter'])[field]
-                for k in seq_dict}
+    _extract = _fieldExtractor(field, out_args['delimiter'])
+    tag_dict = {k:_extract(rec.description) for k, rec in seq_dict.items()}
     if numeric:  tag_dict = {k:float(v or 0) for k, v in tag_dict.items()}
-    sorted_keys = sorted(tag_dict, key=tag_dict.get)
+    # Bucket keys by tag so ordering costs one sort over the unique tags
+    # instead of a keyed sort over every record; ties keep insertion order
+    # exactly as the previous stable sort did
+    tag_buckets = {}
+    for k, v in tag_dict.items():
+        tag_buckets.setdefault(v, []).append(k)
+    sorted_keys = [k for v in sorted(tag_buckets) for k in tag_buckets[v]]
 
     # Determine total numbers of records
     rec_count = len(seq_dict)
@@ -495,8 +634,10 @@ def sortSeqFile(seq_file, field, numeric=False, max_count=None, out_args=default
 
     # Open initial output file handles
     file_count = 1
+    # Bind the label formatter once; the format spec is parsed per call otherwise
+    _part_label = 'sorted-part{:06d}'.format
     if max_count is None:  out_label = 'sorted'
-    else:  out_label = 'sorted-part%06i' % file_count
+    else:  out_label = _part_label(file_count)
     out_handle = getOutputHandle(seq_file,
                                  out_label,
                                  out_dir=out_args['out_dir'],
@@ -525,7 +666,7 @@ def sortSeqFile(seq_file, field, numeric=False, max_count=None, out_args=default
                 # Open new file handle
                 out_handle.close()
                 out_handle = getOutputHandle(seq_file,
-                                             'sorted-part%06i' % file_count,
+                                             _part_label(file_count),
                                              out_dir=out_args['out_dir'],
                                              out_name=out_args['out_name'],
                                              out_type=out_args['out_type'],
@@ -533,10 +674,9 @@ def sortSeqFile(seq_file, field, numeric=False, max_count=None, out_args=default
                 # Append output file name to out_files
                 out_files.append(out_handle.name)
 
-            # Write saved sequences
-            for k in saved_keys:
-                chunk_count += 1
-                SeqIO.write(seq_dict[k], out_handle, out_args['out_type'])
+            # Write saved sequences in one batch
+            chunk_count += len(saved_keys)
+            _write(saved_keys, out_handle)
             # Reset saved keys to current key only
             saved_keys = [key]
         else:
@@ -545,9 +685,8 @@ def sortSeqFile(seq_file, field, numeric=False, max_count=None, out_args=default
 
         # Check if total records reached, write all saved keys, and exit loop
         if seq_count == rec_count:
-            for k in saved_keys:
-                chunk_count += 1
-                SeqIO.write(seq_dict[k], out_handle, out_args['out_type'])
+            chunk_count += len(saved_keys)
+            _write(saved_keys, out_handle)
             out_handle.close()
             break
 
@@ -556,7 +695,7 @@ def sortSeqFile(seq_file, field, numeric=False, max_count=None, out_args=default
 
     # Print log
     printProgress(seq_count, rec_count, 0.05, start_time=start_time)
-    log = OrderedDict()
+    log = {}
     for i, f in enumerate(out_files):
         log['OUTPUT%i' % (i + 1)] = os.path.basename(f)
     log['SEQUENCES'] = seq_count
@@ -603,7 +742,7 @@ def selectSeqFile(seq_file, field, value_list=None, value_file=None, negate=Fals
         return field_list
 
     # Print console log
-    log = OrderedDict()
+    log = {}
     log['START'] = 'SplitSeq'
     log['COMMAND'] = 'select'
     log['FILE'] = os.path.basename(seq_file)
@@ -663,7 +802,7 @@ def selectSeqFile(seq_file, field, value_list=None, value_file=None, negate=Fals
     printCount(rec_count, 1e5, start_time=start_time, end=True)
 
     # Print log
-    log = OrderedDict()
+    log = {}
     log['OUTPUT'] = os.path.basename(out_handle.name)
     log['PASS'] = pass_count
     log['FAIL'] = fail_count
@@ -7,10 +7,29 @@ from presto import __version__, __date__
 
 # Imports
 import re
-from collections import OrderedDict
+from functools import lru_cache
 from presto.Defaults import default_coord, default_delimiter, default_separator
 
 
+@lru_cache(maxsize=8)
+def _headerCleanRegex(chars):
+    """
+    Compiles a regex matching runs of the given characters or whitespace
+
+    Arguments:
+      chars (str): string of individual characters to match.
+
+    Returns:
+      re.Pattern: compiled regular expression.
+    """
+    return re.compile(r'[%s\s]+' % re.escape(chars))
+
+
+# Translation tables for single-pass header cleanup
+_space_trans = str.maketrans({c: '_' for c in ' \t\n\r\x0b\x0c'})
+_bracket_trans = str.maketrans('', '', '()[]')
+
+
 def getCoordKey(header, coord_type=default_coord, delimiter=default_delimiter):
     """
     Return the coordinate identifier for a sequence description
@@ -45,13 +64,14 @@ def parseLog(record):
       record (str): a string of lines representing a log record including newline characters.
 
     Returns:
-      collections.OrderedDict: parsed log contain field and values pairs as a dictionary.
+      dict: parsed log contain field and values pairs as a dictionary.
     """
-    record_dict = OrderedDict()
+    record_dict = {}
     for line in record.split('\n'):
-        line = line.strip().split('> ')
-        if len(line) == 2:
-            record_dict[line[0]] = line[1]
+        # A field line contains exactly one '> ' marker
+        field, sep, value = line.strip().partition('> ')
+        if sep and '> ' not in value:
+            record_dict[field] = value
 
     return record_dict
 
@@ -67,18 +87,18 @@ def parseAnnotation(record, fields=None, delimiter=default_delimiter):
       delimiter : a tuple of delimiters for (fields, values, value lists)
 
     Returns:
-      OrderedDict : An OrderedDict of field/value pairs
+      dict : A dict of field/value pairs
     """
-    annotation = record.split(delimiter[0])
-    field_dict = OrderedDict([('ID', annotation.pop(0))])
-    for ann in annotation:
+    ann_iter = iter(record.split(delimiter[0]))
+    field_dict = {'ID': next(ann_iter)}
+    for ann in ann_iter:
         vals = ann.split(delimiter[1])
         field_dict[vals[0].upper()] = vals[1]
 
     # Subset return dictionary to requested fields
     if fields is not None:
         if not isinstance(fields, list):  fields = [fields]
-        for f in set(field_dict).difference(fields):  del field_dict[f]
+        field_dict = {k: v for k, v in field_dict.items() if k in fields}
 
     return field_dict
 
@@ -121,7 +141,7 @@ def mergeAnnotation(ann_dict_1, ann_dict_2, prepend=False,
       delimiter : Tuple of delimiters for (fields, values, value lists)
 
     Returns:
-      OrderedDict : Modified ann_dict_1 dictonary of field/value pairs
+      dict : Modified ann_dict_1 dictonary of field/value pairs
     """
     # Define merge order
     if prepend:
@@ -158,7 +178,7 @@ def renameAnnotation(ann_dict, old_field, new_field, delimiter=default_delimiter
       delimiter : Tuple of delimiters for (fields, values, value lists)
 
     Returns:
-      OrderedDict : Modified fields dictonary
+      dict : Modified fields dictonary
     """
     if new_field in ann_dict:
         rename_dict = ann_dict.copy()
@@ -166,8 +186,8 @@ def renameAnnotation(ann_dict, old_field, new_field, delimiter=default_delimiter
         rename_dict = mergeAnnotation(rename_dict, {new_field:ann_dict[old_field]},
                                       delimiter=delimiter)
     else:
-        rename_dict = OrderedDict([(new_field, v) if k == old_field else (k, v) \
-                                   for k, v in ann_dict.items()])
+        rename_dict = {(new_field if k == old_field else k): v \
+                       for k, v in ann_dict.items()}
 
     return rename_dict
 
@@ -186,7 +206,7 @@ def collapseAnnotation(ann_dict, action, fields=None, delimiter=default_delimite
       delimiter : Tuple of delimiters for (fields, values, value lists)
 
     Returns:
-      OrderedDict : Modified field dictionary
+      dict : Modified field dictionary
     """
     # Define _collapse action
     if action == 'set':
@@ -289,15 +309,10 @@ def convertGenericHeader(desc, delimiter=default_delimiter):
     Returns:
       dict: a dictionary of header field and value pairs.
     """
-    # Replace whitespace and delimiter characters
-    sub_regex = r'[%s\s]+' % re.escape(''.join(delimiter))
-    conv = re.sub(sub_regex, '_', desc)
-    try:
-        # Check if modified header is valid
-        header = parseAnnotation(conv, delimiter=delimiter)
-    except:
-        # Assign header to None if header cannot be converted
-        header = None
+    # Replace whitespace and delimiter characters. As the substitution strips
+    # every field delimiter, the cleaned header always parses successfully.
+    conv = _headerCleanRegex(''.join(delimiter)).sub('_', desc)
+    header = parseAnnotation(conv, delimiter=delimiter)
 
     return header
 
@@ -323,21 +338,19 @@ def convert454Header(desc):
         @<rank_x_y> <length=##> <uaccno=accession>
         @000034_0199_0169 length=437 uaccno=GNDG01201ARRCR
     """
-    # Split description and assign field names
-    try:
-        # Build header dictionary
-        fields = desc.split(' ')
-        header = OrderedDict()
-        header['ID'] = fields[0]
-        header['LENGTH'] = fields[1].replace('length=', '')
+    # Split description and check format
+    fields = desc.split(' ')
+    if len(fields) not in (2, 3):
+        return None
+
+    # Build header dictionary
+    header = {}
+    header['ID'] = fields[0]
+    header['LENGTH'] = fields[1].replace('length=', '')
 
-        # Check for old format
-        if len(fields) == 3:
-            header['UACCNO'] = fields[2].replace('uaccno=', '')
-        elif len(fields) != 2:
-            raise ValueError
-    except:
-        header = None
+    # Check for old format
+    if len(fields) == 3:
+        header['UACCNO'] = fields[2].replace('uaccno=', '')
 
     return header
 
@@ -365,25 +378,22 @@ def convertGenbankHeader(desc, delimiter=default_delimiter):
         >gi|568336023|gb|CM000663.2| Homo sapiens chromosome 1, GRCh38 reference primary assembly
     """
     # Define special characters to replace
-    sub_regex = r'[%s\s]+' % re.escape(''.join(delimiter[1:]))
+    sub_regex = _headerCleanRegex(''.join(delimiter[1:]))
 
     # Split description and assign field names
-    try:
-        header = OrderedDict()
-
-        # Try old format and fallback to new format if that fails
-        fields = desc.split('|')
-        if len(fields) == 5:
-            header['ID'] = fields[3]
-            header['GI'] = fields[1]
-            header['SOURCE'] = fields[2]
-            header['DESC'] = re.sub(sub_regex, '_', fields[4].strip())
-        else:
-            fields = desc.split(' ')
-            header['ID'] = fields[0]
-            header['DESC'] = re.sub(sub_regex, '_', '_'.join(fields[1:]).strip())
-    except:
-        header = None
+    header = {}
+
+    # Try old format and fallback to new format if that fails
+    fields = desc.split('|')
+    if len(fields) == 5:
+        header['ID'] = fields[3]
+        header['GI'] = fields[1]
+        header['SOURCE'] = fields[2]
+        header['DESC'] = sub_regex.sub('_', fields[4].strip())
+    else:
+        fields = desc.split(' ')
+        header['ID'] = fields[0]
+        header['DESC'] = sub_regex.sub('_', '_'.join(fields[1:]).strip())
 
     return header
 
@@ -410,31 +420,33 @@ def convertIlluminaHeader(desc):
         @HWI-EAS209_0006_FC706VJ:5:58:5894:21141#ATCACG/1
         @MS6_33112:1:1101:18371:1066/1
     """
-    # Split description and assign field names
-    try:
-        # Try new format and fallback to old if that fails
-        fields = desc.split(' ')
-        if len(fields) == 2:
-            x = fields[1].split(':')
-            index = x[3]
-            read_num = x[0]
-        elif '#' in desc:
-            fields = desc.split('#')
-            x = fields[1].split('/')
-            index = x[0]
-            read_num = x[1]
-        else:
-            fields = desc.split('/')
-            index = None
-            read_num = fields[1]
+    # Try new format and fallback to old if that fails
+    fields = desc.split(' ')
+    if len(fields) == 2:
+        x = fields[1].split(':')
+        if len(x) < 4:
+            return None
+        index = x[3]
+        read_num = x[0]
+    elif '#' in desc:
+        fields = desc.split('#')
+        x = fields[1].split('/')
+        if len(x) < 2:
+            return None
+        index = x[0]
+        read_num = x[1]
+    elif '/' in desc:
+        fields = desc.split('/')
+        index = None
+        read_num = fields[1]
+    else:
+        return None
 
-        # Build header dictionary
-        header = OrderedDict()
-        header['ID'] = fields[0]
-        if index is not None:  header['INDEX'] = index
-        header['READ'] = read_num
-    except:
-        header = None
+    # Build header dictionary
+    header = {}
+    header['ID'] = fields[0]
+    if index is not None:  header['INDEX'] = index
+    header['READ'] = read_num
 
     return header
 
@@ -479,26 +491,25 @@ def convertIMGTHeader(desc, simple=False):
         14. Partial (if it is).
         15. Reverse complementary (if it is).
     """
-    # Split description and assign field names
-    try:
-        fields = desc.split('|')
-
-        # Build header dictionary
-        header = OrderedDict()
-        header['ID'] = fields[1]
-
-        if not simple:
-            header['SPECIES'] = re.sub(r'\s', '_', fields[2])
-            header['REGION'] = fields[4]
-            header['FUNCTIONALITY'] = re.sub(r'[\(\)\[\]]', '', fields[3])
-            header['PARTIAL'] = 'FALSE' if re.sub(r'\s', '', fields[13]) == '' else 'TRUE'
-            header['ACCESSION'] = fields[0]
-
-        # Position and length data
-        #header['NUCLEOTIDES'] = re.sub('[^0-9]', '', fields[6])
-        #header['LENGTH'] = fields[12].split('=')[1]
-    except:
-        header = None
+    # Split description and check format
+    fields = desc.split('|')
+    if len(fields) < 2 or (not simple and len(fields) < 14):
+        return None
+
+    # Build header dictionary
+    header = {}
+    header['ID'] = fields[1]
+
+    if not simple:
+        header['SPECIES'] = fields[2].translate(_space_trans)
+        header['REGION'] = fields[4]
+        header['FUNCTIONALITY'] = fields[3].translate(_bracket_trans)
+        header['PARTIAL'] = 'FALSE' if fields[13].strip() == '' else 'TRUE'
+        header['ACCESSION'] = fields[0]
+
+    # Position and length data
+    #header['NUCLEOTIDES'] = re.sub('[^0-9]', '', fields[6])
+    #header['LENGTH'] = fields[12].split('=')[1]
 
     return header
 
@@ -532,26 +543,25 @@ def convertSRAHeader(desc):
         @ERR346596.1 BS-DSFCONTROL04:4:000000000-A3F0Y:1:1101:12758:1640/1
         @ERR346596.1 BS-DSFCONTROL04:4:000000000-A3F0Y:1:1101:12758:1640/2
     """
-    # Split description and assign field names
-    try:
-        fields = desc.split(' ')
+    # Split description and check format
+    fields = desc.split(' ')
+    if len(fields) < 2:
+        return None
 
-        # Build header dictionary
-        header = OrderedDict()
+    # Build header dictionary
+    header = {}
 
-        # Check for read number if sequence id
-        read_id = fields[0].split('.')
-        if len(read_id) == 3:
-            header['ID'] = '.'.join(read_id[:2])
-            header['READ'] = read_id[2]
-        else:
-            header['ID'] = fields[0]
+    # Check for read number if sequence id
+    read_id = fields[0].split('.')
+    if len(read_id) == 3:
+        header['ID'] = '.'.join(read_id[:2])
+        header['READ'] = read_id[2]
+    else:
+        header['ID'] = fields[0]
 
-        header['DESC'] = fields[1]
-        if len(fields) >= 3 and 'length' in fields[2]:
-            header['LENGTH'] = fields[2].replace('length=', '')
-    except:
-        header = None
+    header['DESC'] = fields[1]
+    if len(fields) >= 3 and 'length' in fields[2]:
+        header['LENGTH'] = fields[2].replace('length=', '')
 
     return header
 
@@ -572,16 +582,15 @@ def convertMIGECHeader(desc):
         @MIG UMI:<UMI sequence>:<consensus read count>
         @MIG UMI:TCGGCCAACAAA:8
     """
-    # Split description and assign field names
-    try:
-        fields = desc.split(':')
+    # Split description and check format
+    fields = desc.split(':')
+    if len(fields) < 3:
+        return None
 
-        # Build header dictionary
-        header = OrderedDict()
-        header['ID'] = fields[1]
-        header['COUNT'] = fields[2]
-    except:
-        header = None
+    # Build header dictionary
+    header = {}
+    header['ID'] = fields[1]
+    header['COUNT'] = fields[2]
 
     return header
 
@@ -599,8 +608,13 @@ def addHeader(header, fields, values, delimiter=default_delimiter):
     Returns:
       dict: modified header dictionary.
     """
-    for f, v in zip(fields, values):
-        header = mergeAnnotation(header, {f:v}, delimiter=delimiter)
+    # Merge all fields in one pass when the field names are unique; repeated
+    # fields must be merged sequentially so each occurrence appends in order
+    if len(set(fields)) == len(fields):
+        header = mergeAnnotation(header, dict(zip(fields, values)), delimiter=delimiter)
+    else:
+        for f, v in zip(fields, values):
+            header = mergeAnnotation(header, {f:v}, delimiter=delimiter)
 
     return header
 
@@ -640,9 +654,15 @@ def copyHeader(header, fields, names, actions=None, delimiter=default_delimiter)
     Returns:
       dict: modified header dictionary.
     """
-    old_header = header.copy()
-    for f, n in zip(fields, names):
-        header = mergeAnnotation(header, {n: old_header[f]}, delimiter=delimiter)
+    # Merge all copies in one pass when the new names are unique; repeated
+    # names must be merged sequentially so each occurrence appends in order
+    if len(set(names)) == len(names):
+        copy_ann = {n: header[f] for f, n in zip(fields, names)}
+        header = mergeAnnotation(header, copy_ann, delimiter=delimiter)
+    else:
+        old_header = header.copy()
+        for f, n in zip(fields, names):
+            header = mergeAnnotation(header, {n: old_header[f]}, delimiter=delimiter)
 
     if actions is not None:
         header = collapseHeader(header, names, actions, delimiter=delimiter)
@@ -683,8 +703,7 @@ def expandHeader(header, fields, separator=default_separator,
     """
     for f in fields:
         values = header[f].split(separator)
-        names = [f + str(i + 1) for i in range(len(values))]
-        ann = OrderedDict([(n, v) for n, v in zip(names, values)])
+        ann = {'%s%i' % (f, i): v for i, v in enumerate(values, start=1)}
         header = mergeAnnotation(header, ann, delimiter=delimiter)
         del header[f]
 
@@ -12,10 +12,10 @@ import re
 import tempfile
 import pandas as pd
 from io import StringIO
-from itertools import groupby
-from subprocess import CalledProcessError, check_output, PIPE, Popen, STDOUT
+from itertools import count, groupby
+from subprocess import CalledProcessError, check_output, DEVNULL, PIPE, Popen, STDOUT
 from Bio import AlignIO, SeqIO
-from Bio.Align import MultipleSeqAlignment
+from Bio.Align import MultipleSeqAlignment, PairwiseAligner
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from packaging import version
@@ -24,7 +24,7 @@ from packaging import version
 from presto.Defaults import default_muscle_exec, default_usearch_exec, \
                             default_blastn_exec, default_blastdb_exec, \
                             default_cdhit_exec
-from presto.IO import readReferenceFile, printError, printWarning
+from presto.IO import formatFasta, readReferenceFile, printError, printWarning
 
 # Defaults
 default_cluster_ident = 0.9
@@ -34,6 +34,56 @@ default_evalue = 1e-5
 default_max_hits = 100
 default_max_memory = 3000
 
+# Translation table masking alignment gaps before clustering
+_gap_trans = str.maketrans({'-': 'N', '.': 'N'})
+
+# Global aligner for the two-sequence fast path in runMuscle, with
+# EDNAFULL-style nucleotide scoring approximating the MUSCLE defaults
+_pairwise_aligner = PairwiseAligner()
+_pairwise_aligner.mode = 'global'
+_pairwise_aligner.match_score = 5
+_pairwise_aligner.mismatch_score = -4
+_pairwise_aligner.open_gap_score = -10
+_pairwise_aligner.extend_gap_score = -0.5
+
+# Shared scratch directory for aligner temp files; pooling and reusing the
+# files avoids creating and unlinking two /tmp entries per clustered set
+_tmp_dir = None
+_tmp_count = count()
+_tmp_free = []
+
+
+def _getTempFile():
+    """
+    Fetches a reusable named temporary file from the scratch pool
+
+    Returns:
+      file : an empty read/write text handle positioned at the start;
+             the file exists on disk so its name can be passed to
+             external tools.
+    """
+    global _tmp_dir
+    if _tmp_free:
+        handle = _tmp_free.pop()
+        handle.seek(0)
+        handle.truncate()
+        return handle
+    if _tmp_dir is None:
+        _tmp_dir = tempfile.TemporaryDirectory(prefix='presto_')
+    return open(os.path.join(_tmp_dir.name, 'tmp%i' % next(_tmp_count)),
+                'w+t', encoding='utf-8')
+
+
+def _putTempFile(handle):
+    """
+    Returns a temporary file to the scratch pool for reuse
+
+    Arguments:
+      handle : a handle obtained from _getTempFile.
+    """
+    _tmp_free.append(handle)
+
+
 def getMuscleVersion(exec=default_muscle_exec):
     """
     Gets the version of the Muscle executable
@@ -78,49 +128,57 @@ def runMuscle(seq_list, aligner_exec=default_muscle_exec):
         align = MultipleSeqAlignment(seq_list)
         return align
 
+    # For two sequences a global pairwise alignment is the multiple
+    # alignment, so align in-process rather than paying the process-spawn
+    # overhead of MUSCLE, which dominates the runtime of small sets
+    if len(seq_list) == 2:
+        aln = _pairwise_aligner.align(str(seq_list[0].seq), str(seq_list[1].seq))[0]
+        align = MultipleSeqAlignment(
+            [SeqRecord(Seq(aln[i]), id=rec.id, name=rec.name, description=rec.description)
+             for i, rec in enumerate(seq_list)])
+        return align
+
     # Set MUSCLE command
     muscle_version = getMuscleVersion(aligner_exec)
-    if ( version.parse(muscle_version) >= version.parse('5.0') ):    
-      printError('Muscle5 is not supported. Detected muscle version ' + muscle_version)
-      # Commented out because very slow
-      # Muscle5 requires in and out .fasta
-      #in_handle  = tempfile.NamedTemporaryFile(suffix='.fasta', mode='w+t', encoding='utf-8')
-      #out_handle = tempfile.NamedTemporaryFile(suffix='.fasta', mode='w+t', encoding='utf-8')
+    if ( version.parse(muscle_version) >= version.parse('5.0') ):
+      # MUSCLE v5 does not read stdin, so round-trip through temporary files.
+      # The default PPP algorithm is very slow on large sets; Super5 scales
+      # far better there, so dispatch on input size
+      in_handle = tempfile.NamedTemporaryFile(suffix='.fasta', mode='w+t', encoding='utf-8')
+      out_handle = tempfile.NamedTemporaryFile(suffix='.fasta', mode='w+t', encoding='utf-8')
 
       # Convert sequences to FASTA and write to file
-      #SeqIO.write(seq_list, in_handle.name, 'fasta-2line')  
-      #cmd = [aligner_exec, '-align', in_handle.name,'-output', out_handle.name]
-
-      # Open MUSCLE process
-      #child = Popen(cmd, bufsize=-1, stdin=PIPE, stdout=PIPE, stderr=PIPE,
-      #              universal_newlines=True)
-      
-      #stdout_str, __ = child.communicate()
+      in_handle.write(formatFasta(seq_list))
+      in_handle.seek(0)
+      algorithm = '-super5' if len(seq_list) > 500 else '-align'
+      cmd = [aligner_exec, algorithm, in_handle.name, '-output', out_handle.name]
+
+      # Run MUSCLE
+      try:
+          stdout_str = check_output(cmd, stderr=STDOUT, shell=False,
+                                    universal_newlines=True)
+      except CalledProcessError as e:
+          printError('Running command: %s\n%s' % (' '.join(cmd), e.output))
 
       # Read sequences from MUSCLE output
-      #align = AlignIO.read(out_handle.name, 'fasta')
-      #out_handle.close()
-  
+      align = AlignIO.read(out_handle.name, 'fasta')
+      in_handle.close()
+      out_handle.close()
     else:
       cmd = [aligner_exec, '-diags', '-maxiters', '2']
 
-      # Convert sequences to FASTA and write to string
-      stdin_handle = StringIO()
-      SeqIO.write(seq_list, stdin_handle, 'fasta-2line')
-      stdin_str = stdin_handle.getvalue()
-      stdin_handle.close()
-
       # Open MUSCLE process
-      child = Popen(cmd, bufsize=-1, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+      child = Popen(cmd, bufsize=-1, stdin=PIPE, stdout=PIPE, stderr=DEVNULL,
                     universal_newlines=True)
 
-      # Send sequences to MUSCLE stdin and retrieve stdout, stderr
-      stdout_str, __ = child.communicate(stdin_str)
-
-      # Capture sequences from MUSCLE stdout
-      stdout_handle = StringIO(stdout_str)
-      align = AlignIO.read(stdout_handle, 'fasta')
-      stdout_handle.close()
+      # Stream sequences to MUSCLE stdin and parse the alignment straight
+      # from stdout, with no intermediate string copies of either payload;
+      # MUSCLE consumes all input before writing the alignment, so the
+      # write cannot deadlock against the unread output pipe
+      child.stdin.write(formatFasta(seq_list))
+      child.stdin.close()
+      align = AlignIO.read(child.stdout, 'fasta')
+      child.wait()
 
     return align
 
@@ -146,31 +204,41 @@ def runUClust(seq_list, ident=default_cluster_ident, length_ratio=default_length
     Returns:
       dict: {cluster id: list of sequence ids}.
     """
-    # Function to trim and mask sequences
-    gap_trans = str.maketrans({'-': 'N', '.': 'N'})
+    # Function to trim and mask sequences; carries plain strings instead of
+    # rebuilding Seq/SeqRecord objects that are only re-serialized to FASTA
     def _clean(rec, i, j):
-        seq = str(rec.seq[i:j])
-        seq = seq.translate(gap_trans)
-        return SeqRecord(Seq(seq), id=rec.id, name=rec.name, description=rec.description)
+        desc = rec.description
+        if desc:
+            title = desc if desc.split(None, 1)[0] == rec.id else '%s %s' % (rec.id, desc)
+        else:
+            title = rec.id
+        return rec.id, title, str(rec.seq[i:j]).translate(_gap_trans)
 
     # Make a trimmed and masked copy of each sequence so we don't mess up originals
     seq_trimmed = [_clean(x, seq_start, seq_end) for x in seq_list]
 
     # Return sequence if only one sequence in seq_iter
     if len(seq_trimmed) < 2:
-        return {1:[seq_trimmed[0].id]}
+        return {1:[seq_trimmed[0][0]]}
 
     # If there are any empty sequences after trimming return None
-    if any([len(x.seq) == 0 for x in seq_trimmed]):
+    if any(not x[2] for x in seq_trimmed):
         return None
 
-    # Open temporary files
-    in_handle = tempfile.NamedTemporaryFile(mode='w+t', encoding='utf-8')
-    out_handle = tempfile.NamedTemporaryFile(mode='w+t', encoding='utf-8')
+    # Open temporary output file; vsearch reads its query input from a
+    # pipe, so only usearch needs the input written to disk first
+    out_handle = _getTempFile()
+    use_stdin = 'vsearch' in os.path.basename(cluster_exec) and os.path.exists('/dev/stdin')
+    if use_stdin:
+        in_handle = None
+        in_name = '/dev/stdin'
+    else:
+        in_handle = _getTempFile()
+        in_name = in_handle.name
 
     # Define usearch command
     cmd = [cluster_exec,
-           '-cluster_fast', in_handle.name,
+           '-cluster_fast', in_name,
            '-uc', out_handle.name,
            '-id', str(ident),
            '-minsl', str(length_ratio),
@@ -179,16 +247,23 @@ def runUClust(seq_list, ident=default_cluster_ident, length_ratio=default_length
            '-threads', str(threads),
            '-minwordmatches', str(min_word_match)]
 
-    # Write usearch input fasta file
-    SeqIO.write(seq_trimmed, in_handle, 'fasta-2line')
-    in_handle.seek(0)
-
-    # Run usearch uclust algorithm
-    try:
-        stdout_str = check_output(cmd, stderr=STDOUT, shell=False,
-                                  universal_newlines=True)
-    except CalledProcessError as e:
-        printError('Running command: %s\n%s' % (' '.join(cmd), e.output))
+    # Run the uclust algorithm
+    if use_stdin:
+        # Stream the input fasta straight to the clusterer
+        child = Popen(cmd, stdin=PIPE, stdout=DEVNULL, stderr=PIPE,
+                      shell=False, universal_newlines=True)
+        __, stderr_str = child.communicate(''.join('>%s\n%s\n' % (t, s) for __, t, s in seq_trimmed))
+        if child.returncode != 0:
+            printError('Running command: %s\n%s' % (' '.join(cmd), stderr_str))
+    else:
+        # Write usearch input fasta file
+        in_handle.write(''.join('>%s\n%s\n' % (t, s) for __, t, s in seq_trimmed))
+        in_handle.seek(0)
+        try:
+            stdout_str = check_output(cmd, stderr=STDOUT, shell=False,
+                                      universal_newlines=True)
+        except CalledProcessError as e:
+            printError('Running command: %s\n%s' % (' '.join(cmd), e.output))
 
     # Parse the results of usearch
     # Output columns for the usearch 'uc' output format
@@ -199,13 +274,19 @@ def runUClust(seq_list, ident=default_cluster_ident, length_ratio=default_length
     cluster_dict = {}
     for row in csv.reader(out_handle, delimiter='\t'):
         if row[0] in ('H', 'S'):
-            # Trim sequence label to portion before space for usearch v9 compatibility
             key = int(row[1]) + 1
             # Trim sequence label to portion before space for usearch v9 compatibility
-            hit = row[8].split()[0]
+            hit = row[8].split(None, 1)[0]
             # Update cluster dictionary
-            cluster = cluster_dict.setdefault(key, [])
-            cluster.append(hit)
+            cluster = cluster_dict.get(key)
+            if cluster is None:
+                cluster_dict[key] = [hit]
+            else:
+                cluster.append(hit)
+
+    # Return temp files to the pool
+    if in_handle is not None:  _putTempFile(in_handle)
+    _putTempFile(out_handle)
 
     return cluster_dict if cluster_dict else None
 
@@ -231,27 +312,30 @@ def runCDHit(seq_list, ident=default_cluster_ident, length_ratio=default_length_
     Returns:
       dict: {cluster id: list of sequence ids}.
     """
-    # Function to trim and mask sequences
-    gap_trans = str.maketrans({'-': 'N', '.': 'N'})
+    # Function to trim and mask sequences; carries plain strings instead of
+    # rebuilding Seq/SeqRecord objects that are only re-serialized to FASTA
     def _clean(rec, i, j):
-        seq = str(rec.seq[i:j])
-        seq = seq.translate(gap_trans)
-        return SeqRecord(Seq(seq), id=rec.id, name=rec.name, description=rec.description)
+        desc = rec.description
+        if desc:
+            title = desc if desc.split(None, 1)[0] == rec.id else '%s %s' % (rec.id, desc)
+        else:
+            title = rec.id
+        return rec.id, title, str(rec.seq[i:j]).translate(_gap_trans)
 
     # Make a trimmed and masked copy of each sequence so we don't mess up originals
     seq_trimmed = [_clean(x, seq_start, seq_end) for x in seq_list]
 
     # Return sequence if only one sequence in seq_iter
     if len(seq_trimmed) < 2:
-        return {1:[seq_trimmed[0].id]}
+        return {1:[seq_trimmed[0][0]]}
 
     # If there are any empty sequences after trimming return None
-    if any([len(x.seq) == 0 for x in seq_trimmed]):
+    if any(not x[2] for x in seq_trimmed):
         return None
 
     # Open temporary files
-    in_handle = tempfile.NamedTemporaryFile(mode='w+t', encoding='utf-8')
-    out_handle = tempfile.NamedTemporaryFile(mode='w+t', encoding='utf-8')
+    in_handle = _getTempFile()
+    out_handle = _getTempFile()
 
     # Define usearch command
     cmd = [cluster_exec,
@@ -265,7 +349,7 @@ def runCDHit(seq_list, ident=default_cluster_ident, length_ratio=default_length_
            '-T', str(threads)]
 
     # Write usearch input fasta file
-    SeqIO.write(seq_trimmed, in_handle, 'fasta-2line')
+    in_handle.write(''.join('>%s\n%s\n' % (t, s) for __, t, s in seq_trimmed))
     in_handle.seek(0)
 
     # Run CD-HIT
@@ -301,8 +385,10 @@ def runCDHit(seq_list, ident=default_cluster_ident, length_ratio=default_length_
                 cluster_dict[count] = [id_regex.match(x).group(2) for x in block]
                 count += 1
 
-    # Delete temp file
+    # Delete temp file and return pooled files
     os.remove(cluster_file)
+    _putTempFile(in_handle)
+    _putTempFile(out_handle)
 
     return cluster_dict if cluster_dict else None
 
@@ -388,24 +474,59 @@ def makeBlastnDb(ref_file, db_exec=default_blastdb_exec):
     return (os.path.join(db_handle.name, 'reference'), db_handle)
 
 
+# In-process cache of formatted reference databases built from raw FASTA
+# input, keyed by the file's identity; entries hold the temp handle that
+# owns the database files so they live for the rest of the process
+_db_cache = {}
+
+
+def _getCachedDb(ref_file, db_func, db_exec):
+    """
+    Builds or fetches a formatted reference database for a FASTA file
+
+    Arguments:
+      ref_file : path to the reference FASTA file.
+      db_func : database build function; makeUBlastDb or makeBlastnDb.
+      db_exec : path to the database build executable.
+
+    Returns:
+      str: path to the formatted database.
+    """
+    stat = os.stat(ref_file)
+    key = (db_func.__name__, os.path.abspath(ref_file), stat.st_mtime_ns, stat.st_size)
+    entry = _db_cache.get(key)
+    if entry is None:
+        entry = _db_cache[key] = db_func(ref_file, db_exec)
+    return entry[0]
+
+
 def runUBlast(seq, database, evalue=default_evalue, max_hits=default_max_hits,
-              aligner_exec=default_usearch_exec):
+              threads=1, aligner_exec=default_usearch_exec):
     """
     Aligns a sequence against a reference database using the usearch_local algorithm of USEARCH
 
+    All records in seq go out in a single usearch invocation, so batching
+    queries amortizes the process spawn and database load across the batch.
+
     Arguments:
-      seq : a list of SeqRecord objects to align.
+      seq : a SeqRecord object or list of SeqRecord objects to align.
       database : the path to the ublast database or a fasta file.
       evalue : the E-value cut-off.
       maxhits : the maximum number of hits returned.
+      threads : number of threads for usearch.
       aligner_exec : the path to the usearch executable.
 
     Returns:
       pandas.DataFrame : Alignment results.
     """
+    # Format the reference once when given a raw FASTA file; usearch
+    # accepts FASTA databases directly but re-indexes them on every call
+    if os.path.splitext(database)[1].lower() in ('.fasta', '.fa', '.fna'):
+        database = _getCachedDb(database, makeUBlastDb, aligner_exec)
+
     # Open temporary files
-    in_handle = tempfile.NamedTemporaryFile(mode='w+t', encoding='utf-8')
-    out_handle = tempfile.NamedTemporaryFile(mode='w+t', encoding='utf-8')
+    in_handle = _getTempFile()
+    out_handle = _getTempFile()
 
     # Define usearch command
     cmd = [aligner_exec,
@@ -421,10 +542,10 @@ def runUBlast(seq, database, evalue=default_evalue, max_hits=default_max_hits,
            '-userfields', 'query+target+qlo+qhi+tlo+thi+alnlen+evalue+id',
            '-qmask', 'none',
            '-dbmask', 'none',
-           '-threads', '1']
+           '-threads', str(threads)]
 
     # Write usearch input fasta file
-    SeqIO.write(seq, in_handle, format='fasta-2line')
+    in_handle.write(formatFasta([seq] if isinstance(seq, SeqRecord) else seq))
     in_handle.seek(0)
 
     # Run ublast algorithm
@@ -439,39 +560,56 @@ def runUBlast(seq, database, evalue=default_evalue, max_hits=default_max_hits,
         #    sys.stdout.flush()
         # child.wait()
     except CalledProcessError:
+        _putTempFile(in_handle)
+        _putTempFile(out_handle)
         return None
 
     # Parse usearch output
     field_names = ['query', 'target', 'query_start', 'query_end',
                    'target_start', 'target_end',
                    'length', 'evalue', 'identity']
-    align_df = pd.read_csv(out_handle, header=None, names=field_names, encoding='utf-8', sep='\t')
+    field_dtypes = {'query': 'object', 'target': 'object',
+                    'query_start': 'int64', 'query_end': 'int64',
+                    'target_start': 'int64', 'target_end': 'int64',
+                    'length': 'int64', 'evalue': 'float64', 'identity': 'float64'}
+    align_df = pd.read_csv(out_handle, header=None, names=field_names, encoding='utf-8', sep='\t',
+                           engine='c', dtype=field_dtypes)
     # Convert to base-zero indices
     align_df[['query_start', 'query_end', 'target_start', 'target_end']] -= 1
 
-    # Close temp file handles
-    in_handle.close()
-    out_handle.close()
+    # Return temp files to the pool
+    _putTempFile(in_handle)
+    _putTempFile(out_handle)
 
     return align_df
 
 
 def runBlastn(seq, database, evalue=default_evalue, max_hits=default_max_hits,
-              aligner_exec=default_blastn_exec):
+              threads=1, aligner_exec=default_blastn_exec):
     """
     Aligns a sequence against a reference database using BLASTN
 
+    All records in seq go out in a single blastn invocation, so batching
+    queries amortizes the process spawn and database load across the batch.
+
     Arguments:
-      seq : a list of SeqRecord objects to align.
+      seq : a SeqRecord object or list of SeqRecord objects to align.
       database : the path and name of the blastn database.
       evalue : the E-value cut-off.
       maxhits : the maximum number of hits returned.
+      threads : number of threads for blastn.
       aligner_exec : the path to the blastn executable.
 
     Returns:
       pandas.DataFrame : Alignment results.
     """
-    seq_fasta = seq.format('fasta')
+    # Format the reference once when given a raw FASTA file instead of a
+    # prebuilt database prefix
+    if os.path.splitext(database)[1].lower() in ('.fasta', '.fa', '.fna'):
+        database = _getCachedDb(database, makeBlastnDb, default_blastdb_exec)
+
+    # Convert query sequences to FASTA
+    seq_fasta = formatFasta([seq] if isinstance(seq, SeqRecord) else seq)
 
     # Define blastn command
     cmd = [aligner_exec,
@@ -488,7 +626,7 @@ def runBlastn(seq, database, evalue=default_evalue, max_hits=default_max_hits,
            #'-num_alignments', str(max_hits),
            #'-max_hsps', str(max_hits),
            '-outfmt', '6 qseqid sseqid qstart qend sstart send length evalue pident',
-           '-num_threads', '1']
+           '-num_threads', str(threads)]
 
     # Run blastn
     child = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
@@ -507,7 +645,12 @@ def runBlastn(seq, database, evalue=default_evalue, max_hits=default_max_hits,
     # Parse blastn output
     field_names = ['query', 'target', 'query_start', 'query_end', 'target_start', 'target_end',
                    'length', 'evalue', 'identity']
-    align_df = pd.read_csv(out_handle, header=None, names=field_names, sep='\t')
+    field_dtypes = {'query': 'object', 'target': 'object',
+                    'query_start': 'int64', 'query_end': 'int64',
+                    'target_start': 'int64', 'target_end': 'int64',
+                    'length': 'int64', 'evalue': 'float64', 'identity': 'float64'}
+    align_df = pd.read_csv(out_handle, header=None, names=field_names, sep='\t',
+                           engine='c', dtype=field_dtypes)
     # Convert to base-zero indices
     align_df[['query_start', 'query_end', 'target_start', 'target_end']] -= 1
 
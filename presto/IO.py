@@ -11,9 +11,12 @@ import math
 import re
 import os
 import sys
-from collections import OrderedDict
+from collections import namedtuple
+from functools import lru_cache
 from time import time, strftime
 from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+from Bio.SeqIO.QualityIO import FastqGeneralIterator
 
 # Presto imports
 from presto.Defaults import default_delimiter, default_barcode_field
@@ -34,7 +37,8 @@ def openFile(filename, mode='r'):
     if filename.endswith('.gz'):
         return gzip.open(filename, mode + 't')
     else:
-        return open(filename, mode)
+        # Use a large buffer; sequence files are read and written in bulk
+        return open(filename, mode, buffering=2 ** 20)
 
 
 def readPrimerFile(primer_file, replace_special=True):
@@ -49,8 +53,12 @@ def readPrimerFile(primer_file, replace_special=True):
     Returns:
       dict: Dictionary mapping primer ID to sequence.
     """
-    if replace_special:  parse_id = lambda x: re.sub(r'[\s,=|]+', '_', x)
-    else:  parse_id = lambda x: x
+    if replace_special:
+        # Compile once; re.sub with a string pattern pays a cache lookup per primer
+        special_regex = re.compile(r'[\s,=|]+')
+        parse_id = lambda x: special_regex.sub('_', x)
+    else:
+        parse_id = lambda x: x
 
     with openFile(primer_file, 'r') as primer_handle:
         primer_iter = SeqIO.parse(primer_handle, 'fasta')
@@ -59,10 +67,14 @@ def readPrimerFile(primer_file, replace_special=True):
     return primers
 
 
+@lru_cache(maxsize=256)
 def getFileType(filename):
     """
     Determines the type of a file by file extension
 
+    The result depends only on the filename string, so repeated checks of
+    the same path across a pipeline are served from a cache.
+
     Arguments:
       filename : Filename
 
@@ -146,6 +158,193 @@ def readSeqFile(seq_file, index=False, key_func=None):
     return seq_records
 
 
+def readSeqTuples(seq_file):
+    """
+    Reads FASTA/FASTQ files as raw header and sequence strings
+
+    Faster alternative to readSeqFile for operations that do not require
+    SeqRecord objects, such as header manipulation.
+
+    Arguments:
+      seq_file : FASTA or FASTQ file containing sample sequences
+
+    Returns:
+      iter : an iterator of (description, sequence, quality) tuples, where
+             quality is the ASCII quality string for FASTQ input and None
+             for FASTA input.
+    """
+    # Read and check file
+    try:
+        seq_type = getFileType(seq_file)
+        if seq_type not in ('fasta', 'fastq'):
+            printError('File %s has an unrecognized type.' % seq_file)
+
+        # A large read buffer cuts the syscall count behind the line-based
+        # parsers on plain files; gzip input keeps its own buffering
+        if seq_file.endswith('.gz'):
+            handle = openFile(seq_file, 'r')
+        else:
+            handle = open(seq_file, 'r', buffering=2 ** 20)
+
+        if seq_type == 'fasta':
+            seq_tuples = ((desc, seq, None) for desc, seq in SimpleFastaParser(handle))
+        else:
+            seq_tuples = FastqGeneralIterator(handle)
+    except IOError:
+        printError('File %s cannot be read.' % seq_file)
+    except Exception as e:
+        printError('File %s is invalid with exception: %s.' % (seq_file, e))
+
+    return seq_tuples
+
+
+def _iterFastqBlocks(handle, seq_file):
+    """
+    Iterates over a binary FASTQ handle as raw line blocks
+
+    Records are delimited by the FASTQ grammar rather than by line
+    counting, so wrapped (multi-line) records are handled: sequence lines
+    run until the '+' separator and quality lines until their combined
+    length matches the sequence.
+
+    Arguments:
+      handle : binary file handle opened on a FASTQ file.
+      seq_file : filename behind handle, for error reporting.
+
+    Yields:
+      list : the raw lines of one record, newlines included.
+    """
+    head = handle.readline()
+    while head:
+        if not head.startswith(b'@'):
+            printError('File %s is not in FASTQ format.' % seq_file)
+        block = [head]
+        seq_len = 0
+        line = handle.readline()
+        while line and not line.startswith(b'+'):
+            block.append(line)
+            seq_len += len(line.rstrip())
+            line = handle.readline()
+        if not line:
+            printError('File %s is not in FASTQ format.' % seq_file)
+        block.append(line)
+        # Zero-length records still carry one empty quality line
+        qual_len, qual_lines = 0, 0
+        line = handle.readline()
+        while line and (qual_len < seq_len or qual_lines == 0):
+            block.append(line)
+            qual_len += len(line.rstrip())
+            qual_lines += 1
+            line = handle.readline()
+        if qual_len != seq_len:
+            printError('File %s is not in FASTQ format.' % seq_file)
+        yield block
+        head = line
+
+
+def readSeqBlocks(seq_file):
+    """
+    Iterates over a FASTA/FASTQ file as raw unparsed records
+
+    Pass-through companion to readSeqTuples for operations that copy
+    records unmodified; each record is returned exactly as it appears in
+    the file without parsing or reformatting. Compressed files cannot be
+    read this way.
+
+    Arguments:
+      seq_file : FASTA or FASTQ file containing sample sequences
+
+    Yields:
+      str : the unparsed text of one sequence record, including the
+            trailing newline.
+    """
+    seq_type = getFileType(seq_file)
+    if seq_type not in ('fasta', 'fastq'):
+        printError('File %s has an unrecognized type.' % seq_file)
+    if seq_file.endswith('.gz'):
+        printError('File %s cannot be read as raw records; it is compressed.' % seq_file)
+
+    try:
+        with open(seq_file, 'rb', buffering=2 ** 20) as handle:
+            if seq_type == 'fasta':
+                block = None
+                for line in handle:
+                    if line.startswith(b'>'):
+                        if block:
+                            yield b''.join(block).decode()
+                        block = [line]
+                    elif block is not None:
+                        block.append(line)
+                if block:
+                    yield b''.join(block).decode()
+            else:
+                for block in _iterFastqBlocks(handle, seq_file):
+                    yield b''.join(block).decode()
+    except IOError:
+        printError('File %s cannot be read.' % seq_file)
+
+
+# Byte range of a single record within a sequence file
+SeqOffset = namedtuple('SeqOffset', ['description', 'start', 'length'])
+
+
+def readSeqOffsets(seq_file, key_func=None):
+    """
+    Indexes a FASTA/FASTQ file as byte ranges keyed by sequence identifier
+
+    Lighter alternative to an indexed readSeqFile for operations that only
+    reorder or subset whole records; each record can be copied directly
+    from its byte range without parsing. Compressed files cannot be
+    indexed this way.
+
+    Arguments:
+      seq_file : FASTA or FASTQ file containing sample sequences
+      key_func : the function to convert sequence identifiers to dictionary keys
+
+    Returns:
+      dict : a dictionary mapping sequence identifier to a SeqOffset tuple
+             of (description, start, length), where start and length define
+             the byte range of the record within the file.
+    """
+    seq_type = getFileType(seq_file)
+    if seq_type not in ('fasta', 'fastq'):
+        printError('File %s has an unrecognized type.' % seq_file)
+    if seq_file.endswith('.gz'):
+        printError('File %s cannot be indexed by byte offsets; it is compressed.' % seq_file)
+
+    offsets = {}
+
+    def _add(desc, start, length):
+        key = desc.split(None, 1)[0] if desc else desc
+        if key_func is not None:  key = key_func(key)
+        if key in offsets:
+            printError('File %s contains the duplicate sequence ID %s.' % (seq_file, key))
+        offsets[key] = SeqOffset(desc, start, length)
+
+    try:
+        pos = 0
+        with open(seq_file, 'rb', buffering=2 ** 20) as handle:
+            if seq_type == 'fasta':
+                desc, start = None, 0
+                for line in handle:
+                    if line.startswith(b'>'):
+                        if desc is not None:
+                            _add(desc, start, pos - start)
+                        desc, start = line[1:].rstrip().decode(), pos
+                    pos += len(line)
+                if desc is not None:
+                    _add(desc, start, pos - start)
+            else:
+                for block in _iterFastqBlocks(handle, seq_file):
+                    length = sum(map(len, block))
+                    _add(block[0][1:].rstrip().decode(), pos, length)
+                    pos += length
+    except IOError:
+        printError('File %s cannot be read.' % seq_file)
+
+    return offsets
+
+
 def readReferenceFile(ref_file):
     """
     Create a dictionary of cleaned and ungapped reference sequences.
@@ -179,11 +378,24 @@ def countSeqFile(seq_file):
     """
     # Count records and check file
     try:
-        seq_records = readSeqFile(seq_file, index=True)
-        result_count = len(seq_records)
-        # Close the indexed file if it's a SeqIO.index object
-        if hasattr(seq_records, 'close'):
-            seq_records.close()
+        if getFileType(seq_file) == 'fasta':
+            # FASTA records can be counted with a raw byte scan for header
+            # lines, which avoids both text decoding and record indexing
+            result_count = 0
+            prev = b'\n'
+            with gzip.open(seq_file, 'rb') if seq_file.endswith('.gz') \
+                    else open(seq_file, 'rb') as seq_handle:
+                for chunk in iter(lambda: seq_handle.read(2 ** 20), b''):
+                    if prev == b'\n' and chunk[:1] == b'>':
+                        result_count += 1
+                    result_count += chunk.count(b'\n>')
+                    prev = chunk[-1:]
+        else:
+            seq_records = readSeqFile(seq_file, index=True)
+            result_count = len(seq_records)
+            # Close the indexed file if it's a SeqIO.index object
+            if hasattr(seq_records, 'close'):
+                seq_records.close()
     except IOError:
         printError('File %s cannot be read.' % seq_file)
     except Exception as e:
@@ -206,11 +418,27 @@ def countSeqSets(seq_file, field=default_barcode_field, delimiter=default_delimi
     Returns:
       int : Count of unit set IDs in the sequence file
     """
-    # Count records and check file
+    # Count records and check file; only the header lines carry the set
+    # annotation, so skip sequence and quality parsing entirely
     try:
+        seq_type = getFileType(seq_file)
+        if seq_type not in ('fasta', 'fastq'):
+            printError('File %s has an unrecognized type.' % seq_file)
+
         id_set = set()
-        for seq in readSeqFile(seq_file):
-            id_set.add(parseAnnotation(seq.description, delimiter=delimiter)[field])
+        if seq_type == 'fastq':
+            # Delimit records by the FASTQ grammar so wrapped records are
+            # handled, parsing only each block's header line
+            with gzip.open(seq_file, 'rb') if seq_file.endswith('.gz') \
+                    else open(seq_file, 'rb', buffering=2 ** 20) as seq_handle:
+                for block in _iterFastqBlocks(seq_handle, seq_file):
+                    id_set.add(parseAnnotation(block[0][1:].rstrip().decode(),
+                                               delimiter=delimiter)[field])
+        else:
+            with openFile(seq_file, 'r') as seq_handle:
+                for line in seq_handle:
+                    if line.startswith('>'):
+                        id_set.add(parseAnnotation(line[1:].rstrip(), delimiter=delimiter)[field])
         result_count = len(id_set)
     except IOError:
         printError('File %s cannot be read.' % seq_file)
@@ -222,6 +450,56 @@ def countSeqSets(seq_file, field=default_barcode_field, delimiter=default_delimi
     return result_count
 
 
+def formatSeqString(label, sequence, quality=None, out_type='fasta'):
+    """
+    Formats a single sequence record as a FASTA or FASTQ string
+
+    Arguments:
+      label (str): sequence description line without the leading marker character.
+      sequence (str): nucleotide sequence string.
+      quality (str): ASCII quality string for FASTQ output;
+                     ignored for FASTA output.
+      out_type (str): output format; one of 'fasta' or 'fastq'.
+
+    Returns:
+      str: formatted record string, including the trailing newline.
+    """
+    if out_type == 'fastq':
+        return '@%s\n%s\n+\n%s\n' % (label, sequence, quality)
+    else:
+        # Wrap sequence lines at 60 characters
+        if len(sequence) <= 60:
+            return '>%s\n%s\n' % (label, sequence)
+        lines = [sequence[i:i + 60] for i in range(0, len(sequence), 60)]
+        return '>%s\n%s\n' % (label, '\n'.join(lines))
+
+
+def formatFasta(records):
+    """
+    Formats SeqRecord objects as a single unwrapped FASTA string
+
+    Direct replacement for SeqIO.write with the fasta-2line format when
+    the output is handed to an external tool; skips the per-record writer
+    dispatch and produces identical text.
+
+    Arguments:
+      records (iterable): SeqRecord objects to format.
+
+    Returns:
+      str: the records as one FASTA formatted string with one sequence
+           line per record.
+    """
+    out = []
+    for rec in records:
+        desc = rec.description
+        if desc:
+            title = desc if desc.split(None, 1)[0] == rec.id else '%s %s' % (rec.id, desc)
+        else:
+            title = rec.id
+        out.append('>%s\n%s\n' % (title, rec.seq))
+    return ''.join(out)
+
+
 def getOutputHandle(in_file, out_label=None, out_dir=None, out_name=None, out_type=None, gzip_output=False):
     """
     Opens an output file handle
@@ -317,14 +595,10 @@ def printLog(record, handle=sys.stdout, inset=None):
     # Determine inset
     if inset is None:  inset = max(map(len, record))
 
-    # Assemble log string
-    record_str = ''
-    if isinstance(record, OrderedDict):
-        key_list = list(record.keys())
-    else:
-        key_list = sorted(record)
-    for key in key_list:
-        record_str += '%s%s> %s\n' % (' ' * (inset - len(key)), key, record[key])
+    # Assemble log string in insertion order; plain dict preserves
+    # insertion order on Python 3.7+
+    record_str = ''.join('%s%s> %s\n' % (' ' * (inset - len(key)), key, value)
+                         for key, value in record.items())
 
     # Write log record
     if handle is not None:
@@ -409,6 +683,35 @@ def printCount(current, step, start_time=None, task=None, end=False):
         sys.stdout.flush()
 
 
+@lru_cache(maxsize=16)
+def _progressStride(total, step):
+    """
+    Computes the record stride between progress bar updates
+
+    Arguments:
+      total (int): total task count.
+      step (float): fractional progress increment to print at.
+
+    Returns:
+      int: number of records between updates.
+    """
+    return math.ceil(step * total)
+
+
+@lru_cache(maxsize=16)
+def _progressFormat(total):
+    """
+    Builds the count format specification for a progress bar
+
+    Arguments:
+      total (int): total task count.
+
+    Returns:
+      str: format specification padding counts to the width of total.
+    """
+    return '%i,d' % len(format(total, ',d'))
+
+
 def printProgress(current, total, step, start_time=None, task=None, end=False):
     """
     Prints a progress bar to standard out
@@ -422,22 +725,21 @@ def printProgress(current, total, step, start_time=None, task=None, end=False):
       task (str): name of task to display.
       end (bool): if True print final log (add newline).
     """
+    # Check update condition; the stride and format are constant for a
+    # given total, so cached values serve the per-record calls
     try:
-        # Check update condition
-        update = (current % math.ceil(step*total) == 0)
+        update = current % _progressStride(total, step) == 0
     except:
         # Return on modulo by zero error
         return None
-    else:
-        # Check end condition and return if no update needed
-        if current == total:
-            end = True
-        if not end and not update:
-            return None
+    if current == total:
+        end = True
+    if not end and not update:
+        return None
 
     # Define progress bar
     p = float(current) / total
-    c = format(current, '%i,d' % len(format(total, ',d')))
+    c = format(current, _progressFormat(total))
     bar = '%s |%-20s| %3.0f%% (%s)' % (strftime('%H:%M:%S'), '#' * int(p*20), p*100, c)
 
     # Add run time to bar if start_time is specified
@@ -1473,11 +1473,17 @@ def referenceAssembly(head_seq, tail_seq, ref_dict, ref_db, min_ident=default_as
                   'phred_quality' in head_seq.letter_annotations and \
                   'phred_quality' in tail_seq.letter_annotations
 
-    # Align against reference
-    head_df = align_func(head_seq, database=ref_db, evalue=evalue, max_hits=max_hits,
-                         aligner_exec=aligner_exec)
-    tail_df = align_func(tail_seq, database=ref_db, evalue=evalue, max_hits=max_hits,
-                         aligner_exec=aligner_exec)
+    # Align both reads against the reference in one aligner invocation and
+    # split the hit table by query afterwards; head and tail may share the
+    # same read identifier, so the queries are relabeled for the alignment
+    query_list = [SeqRecord(head_seq.seq, id='head', description=''),
+                  SeqRecord(tail_seq.seq, id='tail', description='')]
+    query_df = align_func(query_list, database=ref_db, evalue=evalue, max_hits=max_hits,
+                          aligner_exec=aligner_exec)
+    if query_df is None:
+        return AssemblyRecord()
+    head_df = query_df[query_df['query'] == 'head']
+    tail_df = query_df[query_df['query'] == 'tail']
 
     # Subset results to matching reference assignments
     align_df = pd.merge(head_df, tail_df, on='target', how='inner', suffixes=('_head', '_tail'))